@@ -3,59 +3,269 @@ API Response Cache Module
 Caches StashDB/FansDB API responses for faster repeated searches
 """
 
+import atexit
+import functools
 import sqlite3
-import hashlib
+import threading
+import time
+import weakref
+from hashlib import blake2b
 import json
-from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Optional, Dict, Any, Iterable, Tuple, Union
+
+# orjson is optional: C-level encode/decode, falls back to stdlib json
+try:
+    import orjson
+    
+    def _dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    
+    _loads = orjson.loads
+    ORJSON_AVAILABLE = True
+except ImportError:
+    def _dumps(obj: Any) -> bytes:
+        return json.dumps(obj).encode()
+    
+    _loads = json.loads
+    ORJSON_AVAILABLE = False
+
+
+@functools.lru_cache(maxsize=4096)
+def _hash_key(query: str, source: str) -> int:
+    """Memoized key hash; the bot repeats the same queries a lot"""
+    digest = blake2b(f"{source}:{query}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+class _ThreadConn:
+    """
+    Owner of one thread's SQLite connection. It is only referenced from that
+    thread's threading.local, so when the thread exits the holder is
+    collected and the finalizer closes the connection.
+    """
+    __slots__ = ('conn', 'close', '__weakref__')
+    
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        # Calling the finalizer closes the connection at most once
+        self.close = weakref.finalize(self, conn.close)
 
 
 class APICache:
     """
     SQLite-based cache for API responses with TTL support.
     
-    Cache key is MD5 hash of "source:query" for fast lookups.
-    Stores query text for debugging, response as JSON, and timestamp.
+    Cache key is a 64-bit integer BLAKE2b hash of "source:query", which
+    doubles as the table's rowid so a lookup is a single b-tree search.
+    Stores query text for debugging, response as JSON bytes, and timestamp.
+    Recently used entries are also kept (encoded) in an in-process LRU so
+    repeated lookups skip SQLite; every hit decodes a fresh copy, so callers
+    may mutate what get() returns without affecting later hits.
     """
     
-    def __init__(self, db_path: str = 'api_cache.db', ttl_hours: int = 24):
+    # Minimum seconds between background sweeps of expired rows
+    SWEEP_INTERVAL = 300
+    
+    # Cache table with all required fields. An INTEGER PRIMARY KEY is the
+    # rowid itself, so there's no separate key index to walk.
+    _CREATE_SQL = '''
+        CREATE TABLE IF NOT EXISTS cache (
+            query_hash INTEGER PRIMARY KEY,
+            query_text TEXT,
+            source TEXT,
+            response BLOB,
+            created_at REAL
+        )
+    '''
+    
+    # Shared SQL for the lookup and upsert paths (get/set/set_many/migration)
+    _SELECT_SQL = '''
+        SELECT response, created_at 
+        FROM cache 
+        WHERE query_hash = ? AND source = ? AND created_at >= ?
+    '''
+    
+    _UPSERT_SQL = '''
+        INSERT OR REPLACE INTO cache 
+        (query_hash, query_text, source, response, created_at)
+        VALUES (?, ?, ?, ?, ?)
+    '''
+    
+    def __init__(self, db_path: str = 'api_cache.db', ttl_hours: int = 24,
+                 mem_max: int = 1024):
         """
         Initialize the API cache.
         
         Args:
             db_path: Path to SQLite database file
             ttl_hours: Time-to-live in hours for cached entries
+            mem_max: Max encoded responses kept in the in-process LRU
         """
         self.db_path = db_path
         self.ttl = timedelta(hours=ttl_hours)
+        self._ttl_seconds = self.ttl.total_seconds()
+        self._mem: "OrderedDict[int, Tuple[float, bytes]]" = OrderedDict()
+        self._mem_max = mem_max
+        self._mem_lock = threading.Lock()
+        self._local = threading.local()
+        self._conns: "weakref.WeakSet[_ThreadConn]" = weakref.WeakSet()
+        self._conns_lock = threading.Lock()
+        self._last_sweep = time.time()
         self._init_db()
+        atexit.register(self.close)
+    
+    def _conn(self) -> sqlite3.Connection:
+        """
+        Get this thread's long-lived connection, opening it on first use.
+        
+        Reusing one connection per thread keeps SQLite's page cache warm
+        and avoids re-opening the db/wal/shm files on every lookup. The
+        connection lives in the thread-local, so it is closed as soon as
+        the thread that opened it exits.
+        """
+        holder = getattr(self._local, 'holder', None)
+        if holder is None:
+            conn = sqlite3.connect(
+                self.db_path,
+                isolation_level=None,
+                check_same_thread=False
+            )
+            # Per-connection tuning (journal_mode is set once in _init_db)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA temp_store=MEMORY')
+            conn.execute('PRAGMA cache_size=-20000')  # ~20 MB page cache
+            conn.execute('PRAGMA mmap_size=268435456')  # 256 MB
+            holder = _ThreadConn(conn)
+            self._local.holder = holder
+            with self._conns_lock:
+                self._conns.add(holder)
+        return holder.conn
+    
+    def _release_conn(self) -> None:
+        """Close the calling thread's connection, if it has one"""
+        holder = getattr(self._local, 'holder', None)
+        if holder is None:
+            return
+        self._local.holder = None
+        holder.close()
+    
+    def close(self) -> None:
+        """Close every connection opened by this cache that is still open"""
+        with self._conns_lock:
+            holders = list(self._conns)
+            self._conns.clear()
+        for holder in holders:
+            try:
+                # Cheap planner-stats refresh before letting go
+                holder.conn.execute('PRAGMA optimize')
+            except sqlite3.Error:
+                pass
+            holder.close()
+        self._local = threading.local()
     
     def _init_db(self) -> None:
         """Initialize the SQLite database with cache table"""
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
+        c = self._conn().cursor()
         
-        # Create cache table with all required fields
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS cache (
-                query_hash TEXT PRIMARY KEY,
-                query_text TEXT,
-                source TEXT,
-                response TEXT,
-                created_at TIMESTAMP
-            )
-        ''')
+        # WAL lets get() read while set() writes and drops the fsync count
+        # per commit; journal_mode is sticky so this only needs doing once.
+        # In-memory databases can't use WAL, so leave their journal alone.
+        if self.db_path != ':memory:':
+            c.execute('PRAGMA journal_mode=WAL')
+        
+        # Older databases keyed rows by a hex-string hash (and some stored ISO
+        # timestamps); those are re-keyed into a fresh table
+        c.execute("SELECT type FROM pragma_table_info('cache') WHERE name = 'query_hash'")
+        row = c.fetchone()
+        if row is not None and row[0].upper() != 'INTEGER':
+            self._migrate_legacy(c)
+        
+        c.execute(self._CREATE_SQL)
         
         # Index for faster cleanup queries
         c.execute('CREATE INDEX IF NOT EXISTS idx_created ON cache(created_at)')
-        c.execute('CREATE INDEX IF NOT EXISTS idx_source ON cache(source)')
         
-        conn.commit()
-        conn.close()
+        # (source, created_at) covers the per-source counts in get_stats and
+        # supersedes the old source-only index
+        c.execute('DROP INDEX IF EXISTS idx_source')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_src_created ON cache(source, created_at)')
+    
+    def _migrate_legacy(self, c: sqlite3.Cursor) -> None:
+        """
+        Move the old text-keyed table aside and copy its rows into a new
+        table, re-hashing from query_text. Everything runs in one
+        transaction, so a failed migration leaves the old table untouched.
+        """
+        c.execute('BEGIN IMMEDIATE')
+        try:
+            c.execute('ALTER TABLE cache RENAME TO cache_legacy')
+            for index in ('idx_created', 'idx_source', 'idx_src_created'):
+                c.execute(f'DROP INDEX IF EXISTS {index}')
+            c.execute(self._CREATE_SQL)
+            
+            # ISO timestamps were written in local time; convert to UNIX seconds
+            c.execute('''
+                SELECT query_text, source, response,
+                       CASE WHEN typeof(created_at) = 'text'
+                            THEN (julianday(created_at, 'utc') - 2440587.5) * 86400.0
+                            ELSE created_at END
+                FROM cache_legacy
+            ''')
+            rows = [
+                (_hash_key(query, source), query, source, response, created_at)
+                for query, source, response, created_at in c.fetchall()
+            ]
+            c.executemany(self._UPSERT_SQL, rows)
+            c.execute('DROP TABLE cache_legacy')
+            c.execute('COMMIT')
+        except Exception:
+            c.execute('ROLLBACK')
+            raise
+    
+    def _make_hash(self, query: str, source: str) -> int:
+        """
+        Generate hash of source + query for cache key.
+        
+        The key is never used cryptographically, so a short BLAKE2b digest
+        (a signed 64-bit int) is plenty and keeps the b-tree keys small.
+        """
+        return _hash_key(query, source)
+    
+    @staticmethod
+    def _encode(response: Union[Dict[Any, Any], bytes]) -> bytes:
+        """JSON-encode a response, passing pre-encoded bytes straight through"""
+        if isinstance(response, (bytes, bytearray, memoryview)):
+            return bytes(response)
+        return _dumps(response)
     
-    def _make_hash(self, query: str, source: str) -> str:
-        """Generate MD5 hash of source + query for cache key"""
-        return hashlib.md5(f"{source}:{query}".encode()).hexdigest()
+    def _remember(self, query_hash: int, created: float, encoded: bytes) -> None:
+        """
+        Store an encoded response in the in-process LRU, evicting the oldest.
+        
+        Keeping the bytes rather than the caller's dict means neither the
+        caller nor a later get() can mutate what other hits see.
+        """
+        with self._mem_lock:
+            self._mem[query_hash] = (created, encoded)
+            self._mem.move_to_end(query_hash)
+            while len(self._mem) > self._mem_max:
+                self._mem.popitem(last=False)
+    
+    def _maybe_sweep(self, now: float) -> None:
+        """Kick off clear_expired in the background if it's been a while"""
+        if now - self._last_sweep < self.SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        threading.Thread(target=self._sweep, daemon=True).start()
+    
+    def _sweep(self) -> None:
+        """Background sweep body; drops its thread's connection when done"""
+        try:
+            self.clear_expired()
+        finally:
+            self._release_conn()
     
     def get(self, query: str, source: str) -> Optional[Dict[Any, Any]]:
         """
@@ -68,67 +278,111 @@ class APICache:
         Returns:
             Cached response dict if cache hit, None if cache miss or expired
         """
-        query_hash = self._make_hash(query, source)
+        if not query or not source:
+            return None
         
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
+        query_hash = self._make_hash(query, source)
         
-        try:
-            c.execute('''
-                SELECT response, created_at 
-                FROM cache 
-                WHERE query_hash = ? AND source = ?
-            ''', (query_hash, source))
-            
-            result = c.fetchone()
-            
-            if result:
-                response_json, created_at = result
-                created = datetime.fromisoformat(created_at)
-                
-                # Check if still valid (not expired)
-                if datetime.now() - created < self.ttl:
-                    return json.loads(response_json)
+        # In-process LRU first: no SQL round-trip, just a decode to a fresh copy
+        with self._mem_lock:
+            hit = self._mem.get(query_hash)
+            if hit is not None:
+                created, encoded = hit
+                if time.time() - created < self._ttl_seconds:
+                    self._mem.move_to_end(query_hash)
                 else:
-                    # Entry expired, remove it
-                    c.execute('DELETE FROM cache WHERE query_hash = ?', (query_hash,))
-                    conn.commit()
+                    del self._mem[query_hash]
+                    hit = None
+        if hit is not None:
+            return _loads(encoded)
         
-        finally:
-            conn.close()
+        now = time.time()
+        self._maybe_sweep(now)
+        
+        c = self._conn().cursor()
+        
+        # Expired rows simply don't match; they're deleted by the periodic
+        # sweep rather than with a write on the read path
+        c.execute(self._SELECT_SQL, (query_hash, source, now - self._ttl_seconds))
+        
+        result = c.fetchone()
+        
+        if result:
+            response_blob, created_at = result
+            # Rows migrated from the legacy table may hold JSON text
+            if isinstance(response_blob, str):
+                response_blob = response_blob.encode()
+            self._remember(query_hash, created_at, bytes(response_blob))
+            return _loads(response_blob)
         
         return None
     
-    def set(self, query: str, source: str, response: Dict[Any, Any]) -> None:
+    def set(self, query: str, source: str, response: Union[Dict[Any, Any], bytes]) -> None:
         """
         Cache an API response.
         
         Args:
             query: The search query string
             source: API source ('stashdb' or 'fansdb')
-            response: The API response dict to cache
+            response: The API response dict to cache, or its already
+                JSON-encoded bytes (stored as-is, skipping re-encoding)
         """
+        # Nothing worth caching, and storing it would poison later lookups;
+        # get() never reads keys with an empty query or source either
+        if not response or not query or not source:
+            return
+        
         query_hash = self._make_hash(query, source)
+        now = time.time()
         
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
+        encoded = self._encode(response)
         
-        try:
-            c.execute('''
-                INSERT OR REPLACE INTO cache 
-                (query_hash, query_text, source, response, created_at)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (
-                query_hash,
-                query,
-                source,
-                json.dumps(response),
-                datetime.now().isoformat()
-            ))
-            conn.commit()
+        c = self._conn().cursor()
         
-        finally:
-            conn.close()
+        c.execute(self._UPSERT_SQL, (
+            query_hash,
+            query,
+            source,
+            encoded,
+            now
+        ))
+        self._remember(query_hash, now, encoded)
+    
+    def set_many(self, items: Iterable[Tuple[str, str, Union[Dict[Any, Any], bytes]]]) -> int:
+        """
+        Cache several API responses in one transaction (one commit).
+        
+        Args:
+            items: Iterable of (query, source, response) tuples; responses
+                may be dicts or pre-encoded JSON bytes as in set()
+            
+        Returns:
+            Number of entries written
+        """
+        now = time.time()
+        entries = [
+            (self._make_hash(query, source), query, source, self._encode(response))
+            for query, source, response in items
+            if response and query and source
+        ]
+        if not entries:
+            return 0
+        
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(self._UPSERT_SQL, [
+                (query_hash, query, source, encoded, now)
+                for query_hash, query, source, encoded in entries
+            ])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        
+        for query_hash, _, _, encoded in entries:
+            self._remember(query_hash, now, encoded)
+        return len(entries)
     
     def clear_expired(self) -> int:
         """
@@ -137,19 +391,16 @@ class APICache:
         Returns:
             Number of entries removed
         """
-        cutoff = (datetime.now() - self.ttl).isoformat()
+        cutoff = time.time() - self._ttl_seconds
         
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
+        with self._mem_lock:
+            for key in [k for k, (created, _) in self._mem.items() if created < cutoff]:
+                del self._mem[key]
         
-        try:
-            c.execute('DELETE FROM cache WHERE created_at < ?', (cutoff,))
-            deleted = c.rowcount
-            conn.commit()
-            return deleted
+        c = self._conn().cursor()
         
-        finally:
-            conn.close()
+        c.execute('DELETE FROM cache WHERE created_at < ?', (cutoff,))
+        return c.rowcount
     
     def clear_all(self) -> int:
         """
@@ -158,17 +409,13 @@ class APICache:
         Returns:
             Number of entries removed
         """
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
+        with self._mem_lock:
+            self._mem.clear()
         
-        try:
-            c.execute('DELETE FROM cache')
-            deleted = c.rowcount
-            conn.commit()
-            return deleted
+        c = self._conn().cursor()
         
-        finally:
-            conn.close()
+        c.execute('DELETE FROM cache')
+        return c.rowcount
     
     def get_stats(self) -> Dict[str, Any]:
         """
@@ -177,37 +424,32 @@ class APICache:
         Returns:
             Dict with total_entries, expired_entries, sources breakdown
         """
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
+        c = self._conn().cursor()
         
-        try:
-            # Total entries
-            c.execute('SELECT COUNT(*) FROM cache')
-            total = c.fetchone()[0]
-            
-            # Expired entries
-            cutoff = (datetime.now() - self.ttl).isoformat()
-            c.execute('SELECT COUNT(*) FROM cache WHERE created_at < ?', (cutoff,))
-            expired = c.fetchone()[0]
-            
-            # By source
-            c.execute('''
-                SELECT source, COUNT(*) 
-                FROM cache 
-                GROUP BY source
-            ''')
-            sources = {row[0]: row[1] for row in c.fetchall()}
-            
-            return {
-                'total_entries': total,
-                'expired_entries': expired,
-                'valid_entries': total - expired,
-                'by_source': sources,
-                'ttl_hours': self.ttl.total_seconds() / 3600
-            }
+        # Total entries
+        c.execute('SELECT COUNT(*) FROM cache')
+        total = c.fetchone()[0]
         
-        finally:
-            conn.close()
+        # Expired entries
+        cutoff = time.time() - self._ttl_seconds
+        c.execute('SELECT COUNT(*) FROM cache WHERE created_at < ?', (cutoff,))
+        expired = c.fetchone()[0]
+        
+        # By source
+        c.execute('''
+            SELECT source, COUNT(*) 
+            FROM cache 
+            GROUP BY source
+        ''')
+        sources = {row[0]: row[1] for row in c.fetchall()}
+        
+        return {
+            'total_entries': total,
+            'expired_entries': expired,
+            'valid_entries': total - expired,
+            'by_source': sources,
+            'ttl_hours': self._ttl_seconds / 3600
+        }
 
 
 # Global cache instance for use across the module
@@ -225,6 +467,8 @@ def get_cache(db_path: str = 'api_cache.db', ttl_hours: int = 24) -> APICache:
 def reset_cache():
     """Reset the default cache instance (useful for testing)"""
     global _default_cache
+    if _default_cache is not None:
+        _default_cache.close()
     _default_cache = None
 
 
@@ -274,6 +518,32 @@ if __name__ == '__main__':
         else:
             print("✗ Should have been cache miss")
         
+        # Test that hits are independent copies of what was cached
+        original = {'x': 1}
+        cache.set('copy query', 'stashdb', original)
+        original['x'] = 99
+        first = cache.get('copy query', 'stashdb')
+        first['x'] = 42
+        if cache.get('copy query', 'stashdb') == {'x': 1}:
+            print("✓ Cached responses are unaffected by caller mutation")
+        else:
+            print("✗ Cached response was mutated")
+        
+        # Test batched set
+        written = cache.set_many([('batch1', 'stashdb', {'n': 1}), ('batch2', 'fansdb', {'n': 2}), ('empty', 'stashdb', {})])
+        if written == 2 and cache.get('batch2', 'fansdb') == {'n': 2}:
+            print("✓ set_many: Cached 2 responses in one transaction")
+        else:
+            print("✗ set_many failed")
+        
+        # Test pre-encoded response
+        cache.set('raw query', 'stashdb', b'{"id": "raw-1"}')
+        cached = cache.get('raw query', 'stashdb')
+        if cached and cached['id'] == 'raw-1':
+            print("✓ Pre-encoded bytes stored without re-encoding")
+        else:
+            print("✗ Pre-encoded set failed")
+        
         # Test stats
         stats = cache.get_stats()
         print(f"✓ Cache stats: {stats}")
@@ -305,4 +575,7 @@ if __name__ == '__main__':
         print("\n✅ All tests passed!")
         
     finally:
-        os.unlink(temp_path)
+        cache.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(temp_path + suffix):
+                os.unlink(temp_path + suffix)
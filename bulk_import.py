@@ -9,9 +9,12 @@ import sqlite3
 import asyncio
 import re
 from telethon import TelegramClient
-from telethon.tl.types import Channel
+from telethon.tl.types import Channel, DocumentAttributeVideo, DocumentAttributeFilename, InputMessagesFilterVideo
 from dotenv import load_dotenv
 
+from db_utils import configure_sqlite, ensure_unique_file_ids
+from rate_limiter import RateLimiter
+
 load_dotenv()
 
 # Telethon credentials
@@ -20,6 +23,16 @@ API_HASH = os.getenv('TELEGRAM_API_HASH', '')
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 DB_PATH = 'stash.db'
 
+# Rows buffered before each commit (one fsync per batch, not per video)
+BATCH_SIZE = 100
+
+# Max seconds the DB writer waits to fill a batch before committing anyway
+FLUSH_INTERVAL = 1.0
+
+# Forwarding limits: requests in flight, and forwards/second across all of them
+FORWARD_CONCURRENCY = 8
+FORWARD_RATE = 20
+
 # Domain to category mapping (same as bot.py)
 DOMAIN_CATEGORIES = {
     'brazzers': 'Brazzers',
@@ -61,6 +74,33 @@ DOMAIN_CATEGORIES = {
     'massage': 'Massage',
 }
 
+# (keyword, category) pairs, most specific (longest) keyword first
+_ORDERED_KEYWORDS = tuple(sorted(DOMAIN_CATEGORIES.items(), key=lambda kv: -len(kv[0])))
+
+# All keywords in one alternation, longest first so e.g. 'blackedraw' wins
+# over 'blacked'. One regex pass replaces a substring test per keyword;
+# the lookahead makes it report overlapping hits too ('pornhubrazzers' yields
+# both 'pornhub' and 'brazzers').
+KEYWORD_RE = re.compile('(?=(' + '|'.join(re.escape(kw) for kw, _ in _ORDERED_KEYWORDS) + '))')
+
+# Domain/tag patterns, compiled once at import
+_DOMAIN_PATTERNS = tuple(re.compile(p) for p in [
+    r'\[([^\]]+)\]',
+    r'\(([^\)]+)\)',
+    r'www\.([a-z0-9]+)',
+    r'([a-z0-9]+)\.com',
+    r'([a-z0-9]+)\.net',
+    r'([a-z0-9]+)\.org',
+    r'([a-z0-9]+)\.tv',
+    r'([a-z0-9]+)\.xxx',
+    r'([a-z0-9]+)_',
+    r'_([a-z0-9]+)',
+    r'-([a-z0-9]+)-',
+])
+
+# Strips '.', '-' and '_' in a single pass
+_STRIP = str.maketrans('', '', '.-_')
+
 def extract_category_from_title(title):
     """Extract category from video title based on domains/keywords"""
     if not title:
@@ -69,34 +109,36 @@ def extract_category_from_title(title):
     title_lower = title.lower()
     
     # Check for domain patterns
-    patterns = [
-        r'\[([^\]]+)\]',
-        r'\(([^\)]+)\)',
-        r'www\.([a-z0-9]+)',
-        r'([a-z0-9]+)\.com',
-        r'([a-z0-9]+)\.net',
-        r'([a-z0-9]+)\.org',
-        r'([a-z0-9]+)\.tv',
-        r'([a-z0-9]+)\.xxx',
-        r'([a-z0-9]+)_',
-        r'_([a-z0-9]+)',
-        r'-([a-z0-9]+)-',
-    ]
-    
-    for pattern in patterns:
-        matches = re.findall(pattern, title_lower)
-        for match in matches:
-            clean_match = match.strip().replace('.', '').replace('-', '').replace('_', '')
+    for pattern in _DOMAIN_PATTERNS:
+        for m in pattern.finditer(title_lower):
+            clean_match = m.group(1).strip().translate(_STRIP)
             if clean_match in DOMAIN_CATEGORIES:
                 return DOMAIN_CATEGORIES[clean_match]
     
-    # Direct keyword matching
-    for keyword, category in DOMAIN_CATEGORIES.items():
-        if keyword in title_lower:
-            return category
+    # Direct keyword matching: prefer the most specific keyword anywhere in
+    # the title, so 'teen blackedraw' is Blacked Raw rather than Teen
+    matches = [m.group(1) for m in KEYWORD_RE.finditer(title_lower)]
+    if matches:
+        return DOMAIN_CATEGORIES[max(matches, key=len)]
     
     return None
 
+def flush_videos(conn, rows):
+    """Insert a batch of video rows in one transaction, returns how many were new"""
+    if not rows:
+        return 0
+    before = conn.total_changes
+    try:
+        conn.executemany("""
+            INSERT OR IGNORE INTO videos (file_id, title, duration, category, source_channel)
+            VALUES (?, ?, ?, ?, ?)
+        """, rows)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return conn.total_changes - before
+
 async def import_from_channel(channel_id_str):
     """Import videos from channel using the bot"""
     
@@ -113,6 +155,7 @@ async def import_from_channel(channel_id_str):
     
     # Connect using bot token
     client = TelegramClient('stash_import_session', API_ID, API_HASH)
+    conn = None
     
     try:
         print("🍑💦 Lilly's Bulk Import Tool\n")
@@ -121,9 +164,10 @@ async def import_from_channel(channel_id_str):
         me = await client.get_me()
         print(f"✅ Connected as @{me.username}\n")
         
-        # Connect to DB
-        conn = sqlite3.connect(DB_PATH)
+        # Connect to DB (writes happen on a worker thread, see db_writer)
+        conn = configure_sqlite(sqlite3.connect(DB_PATH, check_same_thread=False))
         c = conn.cursor()
+        ensure_unique_file_ids(conn)
         
         # Try to get channel using the integer ID directly
         try:
@@ -131,9 +175,8 @@ async def import_from_channel(channel_id_str):
             from telethon.tl.types import PeerChannel
             
             # Remove the -100 prefix if present for the raw ID
-            raw_id = channel_id
-            if str(channel_id).startswith('-100'):
-                raw_id = int(str(channel_id)[4:])
+            # (-1001234567890 -> 1234567890)
+            raw_id = -channel_id - 10**12 if channel_id < -10**12 else channel_id
             
             peer = PeerChannel(raw_id)
             channel = await client.get_entity(peer)
@@ -154,53 +197,61 @@ async def import_from_channel(channel_id_str):
         skipped = 0
         total_checked = 0
         videos_found = 0
+        batch = []
+        db_queue = asyncio.Queue()
         
-        # Iterate through ALL messages
-        async for message in client.iter_messages(channel, limit=None):
-            total_checked += 1
-            
-            # Progress every 100 messages
-            if total_checked % 100 == 0:
-                print(f"📊 Checked: {total_checked} | Videos: {videos_found} | Saved: {saved} | Skipped: {skipped}")
-            
-            # Check for video
-            if message.video or (message.document and message.document.mime_type and message.document.mime_type.startswith('video/')):
-                videos_found += 1
+        # References already in the DB for this channel, so re-runs can skip
+        # duplicates before paying for the forward round-trip. A range on the
+        # prefix (':' + 1 is ';') can seek uq_videos_fileid; LIKE can't, since
+        # it's case-insensitive and would scan the whole table.
+        ref_prefix = f"telethon_ref:{channel_id}:"
+        c.execute(
+            "SELECT file_id FROM videos WHERE file_id >= ? AND file_id < ?",
+            (ref_prefix, ref_prefix[:-1] + ';')
+        )
+        existing = {row[0] for row in c}
+        if existing:
+            print(f"⏭ {len(existing):,} videos from this channel already imported\n")
+        
+        # Forwards run concurrently but share one rate budget, so the
+        # flood limit applies to the whole import rather than per video
+        semaphore = asyncio.Semaphore(FORWARD_CONCURRENCY)
+        limiter = RateLimiter(FORWARD_RATE)
+        
+        async def process_video(message):
+            """Forward one video to ourselves and queue its DB row"""
+            try:
+                # Get video details
+                doc = message.video or message.document
+                
+                # Get duration and filename in one pass over the attributes
+                duration = 0
+                file_name = None
+                for attr in doc.attributes or ():
+                    if isinstance(attr, DocumentAttributeVideo):
+                        duration = attr.duration
+                    elif isinstance(attr, DocumentAttributeFilename):
+                        file_name = attr.file_name
+                
+                # Get title from filename or caption
+                title = None
+                if file_name:
+                    title = os.path.splitext(file_name)[0].replace('_', ' ').replace('-', ' ')
+                
+                if not title and message.message:
+                    title = message.message[:100]
                 
+                if not title:
+                    title = f"Video {message.id}"
+                
+                # Extract category from title
+                category = extract_category_from_title(title)
+                
+                # We need to forward to the bot to get a usable file_id
+                # Forward the message to the bot itself
                 try:
-                    # Get video details
-                    doc = message.video or message.document
-                    
-                    # Get duration
-                    duration = 0
-                    if doc.attributes:
-                        for attr in doc.attributes:
-                            if hasattr(attr, 'duration'):
-                                duration = attr.duration
-                                break
-                    
-                    # Get title from filename or caption
-                    title = None
-                    if doc.attributes:
-                        for attr in doc.attributes:
-                            if hasattr(attr, 'file_name') and attr.file_name:
-                                import os
-                                title = os.path.splitext(attr.file_name)[0].replace('_', ' ').replace('-', ' ')
-                                break
-                    
-                    if not title and message.message:
-                        title = message.message[:100]
-                    
-                    if not title:
-                        title = f"Video {message.id}"
-                    
-                    # Extract category from title
-                    category = extract_category_from_title(title)
-                    
-                    # We need to forward to the bot to get a usable file_id
-                    # Forward the message to the bot itself
-                    try:
-                        from telethon.tl.types import InputPeerSelf
+                    async with semaphore:
+                        await limiter.acquire()
                         
                         # Forward to ourselves (the bot)
                         forwarded = await client.forward_messages('me', message)
@@ -209,38 +260,86 @@ async def import_from_channel(channel_id_str):
                             # The file_id format for bot API can't be directly obtained from Telethon
                             # But we can store a reference that lets us resend
                             # Format: telethon_ref:channel_id:message_id
-                            file_ref = f"telethon_ref:{channel_id}:{message.id}"
+                            file_ref = f"{ref_prefix}{message.id}"
                             
-                            # Try to save
-                            try:
-                                c.execute("""
-                                    INSERT INTO videos (file_id, title, duration, category, source_channel)
-                                    VALUES (?, ?, ?, ?, ?)
-                                """, (file_ref, title, duration, category, channel.title))
-                                conn.commit()
-                                saved += 1
-                                cat_info = f" [{category}]" if category else ""
-                                print(f"✅ Saved: {title[:60]}{cat_info}")
-                            except sqlite3.IntegrityError:
-                                skipped += 1
-                            except Exception as e:
-                                print(f"⚠️ DB error: {e}")
+                            # Hand off to the DB writer
+                            await db_queue.put((file_ref, title, duration, category, channel.title))
+                            cat_info = f" [{category}]" if category else ""
+                            print(f"✅ Queued: {title[:60]}{cat_info}")
                             
                             # Delete forwarded message to keep clean
                             await forwarded.delete()
-                            
-                            # Small delay to not flood
-                            await asyncio.sleep(0.2)
-                            
-                    except Exception as e:
-                        print(f"⚠️ Forward error: {e}")
-                        continue
                         
                 except Exception as e:
-                    print(f"⚠️ Error processing message {message.id}: {e}")
-                    continue
+                    print(f"⚠️ Forward error: {e}")
+                    
+            except Exception as e:
+                print(f"⚠️ Error processing message {message.id}: {e}")
+        
+        async def db_writer():
+            """Drain db_queue in batches, committing on a worker thread"""
+            nonlocal saved, skipped
+            loop = asyncio.get_running_loop()
+            done = False
+            
+            while not done:
+                row = await db_queue.get()
+                if row is None:
+                    break
+                
+                # Collect up to BATCH_SIZE rows, or whatever arrives in FLUSH_INTERVAL
+                rows = [row]
+                deadline = loop.time() + FLUSH_INTERVAL
+                while len(rows) < BATCH_SIZE:
+                    try:
+                        row = await asyncio.wait_for(db_queue.get(), deadline - loop.time())
+                    except asyncio.TimeoutError:
+                        break
+                    if row is None:
+                        done = True
+                        break
+                    rows.append(row)
+                
+                # The fsync happens off the event loop, so fetching continues
+                try:
+                    new = await asyncio.to_thread(flush_videos, conn, rows)
+                    saved += new
+                    skipped += len(rows) - new
+                except Exception as e:
+                    print(f"⚠️ DB error: {e}")
+        
+        writer = asyncio.create_task(db_writer())
         
-        conn.close()
+        # Always stop the writer, even if the scan fails, so rows already
+        # queued are saved before the connection is closed
+        try:
+            # Iterate through ALL messages (wait_time=0 drops Telethon's
+            # default 1s pause between history pages on unlimited scans)
+            async for message in client.iter_messages(channel, limit=None, wait_time=0, filter=InputMessagesFilterVideo()):
+                total_checked += 1
+                
+                # Progress every 100 messages
+                if total_checked % 100 == 0:
+                    print(f"📊 Checked: {total_checked} | Videos: {videos_found} | Saved: {saved} | Skipped: {skipped}")
+                
+                videos_found += 1
+                
+                if f"{ref_prefix}{message.id}" in existing:
+                    skipped += 1
+                    continue
+                
+                batch.append(message)
+                
+                if len(batch) >= BATCH_SIZE:
+                    await asyncio.gather(*(process_video(m) for m in batch))
+                    batch.clear()
+            
+            # Finish the last partial batch
+            await asyncio.gather(*(process_video(m) for m in batch))
+            batch.clear()
+        finally:
+            await db_queue.put(None)
+            await writer
         
         print(f"\n" + "="*50)
         print(f"✅ IMPORT COMPLETE!")
@@ -256,6 +355,8 @@ async def import_from_channel(channel_id_str):
         import traceback
         traceback.print_exc()
     finally:
+        if conn is not None:
+            conn.close()
         await client.disconnect()
 
 
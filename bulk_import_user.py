@@ -7,10 +7,14 @@ import os
 import sys
 import sqlite3
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from telethon import TelegramClient
-from telethon.tl.types import PeerChannel
+from telethon.errors import FloodWaitError
+from telethon.tl.types import PeerChannel, DocumentAttributeVideo, DocumentAttributeFilename, InputMessagesFilterVideo
 from dotenv import load_dotenv
 
+from db_utils import configure_sqlite, ensure_unique_file_ids
+
 load_dotenv()
 
 # Telethon credentials
@@ -21,6 +25,73 @@ DB_PATH = 'stash.db'
 # Session name for user account
 SESSION_NAME = 'stash_user_session'
 
+# Videos written per transaction
+BATCH_SIZE = 1000
+
+# Max seconds the DB writer waits to fill a batch before committing anyway
+FLUSH_INTERVAL = 0.5
+
+# Rows allowed to queue up between the message scan and the DB writer
+QUEUE_SIZE = 5000
+
+def open_db():
+    """Open stash.db; called on the writer thread, which then owns the connection"""
+    conn = configure_sqlite(sqlite3.connect(DB_PATH))
+    # INSERT OR IGNORE in flush_videos only skips duplicates with this in place
+    ensure_unique_file_ids(conn)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS channel_state (
+            channel_id INTEGER PRIMARY KEY,
+            last_message_id INTEGER NOT NULL
+        )
+    """)
+    conn.commit()
+    return conn
+
+def load_last_id(conn, channel_id):
+    """Highest message id already imported from this channel (0 if never imported)"""
+    row = conn.execute(
+        "SELECT last_message_id FROM channel_state WHERE channel_id = ?", (channel_id,)
+    ).fetchone()
+    return row[0] if row else 0
+
+def _save_last_id(conn, channel_id, last_message_id):
+    conn.execute("""
+        INSERT INTO channel_state (channel_id, last_message_id) VALUES (?, ?)
+        ON CONFLICT(channel_id) DO UPDATE SET
+            last_message_id = MAX(last_message_id, excluded.last_message_id)
+    """, (channel_id, last_message_id))
+
+def save_last_id(conn, channel_id, last_message_id):
+    """Record how far the channel has been scanned"""
+    _save_last_id(conn, channel_id, last_message_id)
+    conn.commit()
+
+def flush_videos(conn, rows, channel_id, last_message_id):
+    """
+    Insert a batch of video rows in one transaction, returns how many were new.
+    The channel's last imported message id advances in the same transaction,
+    so an interrupted run never skips videos that weren't saved. Pass
+    last_message_id=None to save the rows without moving the mark.
+    """
+    if not rows:
+        return 0
+    before = conn.total_changes
+    conn.execute("BEGIN")
+    try:
+        conn.executemany("""
+            INSERT OR IGNORE INTO videos (file_id, title, duration, source_channel)
+            VALUES (?, ?, ?, ?)
+        """, rows)
+        inserted = conn.total_changes - before
+        if last_message_id is not None:
+            _save_last_id(conn, channel_id, last_message_id)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return inserted
+
 async def import_with_user_account(channel_id_str, phone_number):
     """
     Import videos using a user account (can read history!)
@@ -43,6 +114,12 @@ async def import_with_user_account(channel_id_str, phone_number):
     # This allows reading history
     client = TelegramClient(SESSION_NAME, API_ID, API_HASH)
     
+    # SQLite allows one writer at a time, so every DB call goes through a
+    # single dedicated thread and never blocks the event loop
+    db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='stash-db')
+    loop = asyncio.get_running_loop()
+    conn = None
+    
     try:
         print("🍑💦 Lilly's Bulk Import Tool (User Account)\n")
         
@@ -53,15 +130,12 @@ async def import_with_user_account(channel_id_str, phone_number):
         print(f"✅ Logged in as: {me.first_name} (@{me.username or 'no_username'})\n")
         
         # Connect to DB
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
+        conn = await loop.run_in_executor(db_executor, open_db)
         
         # Get channel
         try:
-            # Handle the -100 prefix
-            raw_id = channel_id
-            if str(channel_id).startswith('-100'):
-                raw_id = int(str(channel_id)[4:])
+            # Handle the -100 prefix (-1001234567890 -> 1234567890)
+            raw_id = -channel_id - 10**12 if channel_id < -10**12 else channel_id
             
             peer = PeerChannel(raw_id)
             channel = await client.get_entity(peer)
@@ -73,89 +147,139 @@ async def import_with_user_account(channel_id_str, phone_number):
             print("2. Channel ID is correct")
             return
         
+        # Only fetch messages newer than the last import
+        last_id = await loop.run_in_executor(db_executor, load_last_id, conn, channel_id)
+        
         print(f"📺 Channel: {channel.title}")
         print(f"🆔 ID: {channel_id}")
-        print(f"🚀 Starting bulk import of ALL videos...\n")
-        print("⚠️  This will take time. Don't close the terminal!\n")
+        if last_id:
+            print(f"🔁 Resuming after message {last_id}\n")
+        else:
+            print(f"🚀 Starting bulk import of ALL videos...\n")
+            print("⚠️  This will take time. Don't close the terminal!\n")
         
         saved = 0
         skipped = 0
         total_checked = 0
         videos_found = 0
         last_saved_title = ""
+        db_errors = 0
+        db_queue = asyncio.Queue(maxsize=QUEUE_SIZE)
         
-        # Iterate through ALL messages (no limit!)
-        async for message in client.iter_messages(channel, limit=None):
-            total_checked += 1
+        async def db_writer():
+            """Consume rows from db_queue and write them in batches"""
+            nonlocal saved, skipped, last_saved_title, db_errors
+            done = False
             
-            # Progress report every 500 messages
-            if total_checked % 500 == 0:
-                print(f"📊 Progress: Checked {total_checked} messages | Videos: {videos_found} | Saved: {saved} | Skipped: {skipped}")
-                if last_saved_title:
-                    print(f"   Last saved: {last_saved_title[:50]}...")
-                print()
-            
-            # Check for video
-            if message.video or (message.document and message.document.mime_type and message.document.mime_type.startswith('video/')):
-                videos_found += 1
+            # Queue items are (message_id, row); message ids arrive in ascending order
+            while not done:
+                row = await db_queue.get()
+                if row is None:
+                    break
                 
-                try:
-                    doc = message.video or message.document
-                    
-                    # Get duration
-                    duration = 0
-                    if doc.attributes:
-                        for attr in doc.attributes:
-                            if hasattr(attr, 'duration'):
-                                duration = attr.duration
-                                break
-                    
-                    # Get title
-                    title = None
-                    if doc.attributes:
-                        for attr in doc.attributes:
-                            if hasattr(attr, 'file_name') and attr.file_name:
-                                import os
-                                title = os.path.splitext(attr.file_name)[0].replace('_', ' ').replace('-', ' ')
-                                break
-                    
-                    if not title and message.message:
-                        title = message.message[:100]
-                    
-                    if not title:
-                        title = f"Video_{message.id}"
-                    
-                    # Store reference: user_account:channel_id:message_id
-                    # The bot can later use this to request the file
-                    file_ref = f"user_ref:{channel_id}:{message.id}"
-                    
-                    # Save to DB
+                # Collect up to BATCH_SIZE rows, or whatever arrives in FLUSH_INTERVAL
+                rows = [row]
+                deadline = loop.time() + FLUSH_INTERVAL
+                while len(rows) < BATCH_SIZE:
                     try:
-                        c.execute("""
-                            INSERT INTO videos (file_id, title, duration, source_channel)
-                            VALUES (?, ?, ?, ?)
-                        """, (file_ref, title, duration, channel.title))
-                        conn.commit()
-                        saved += 1
-                        last_saved_title = title
+                        row = await asyncio.wait_for(db_queue.get(), deadline - loop.time())
+                    except asyncio.TimeoutError:
+                        break
+                    if row is None:
+                        done = True
+                        break
+                    rows.append(row)
+                
+                # Commit on the DB thread so the message scan keeps going.
+                # Once a batch has failed the mark must stay below its rows,
+                # so later batches are still saved but no longer advance it.
+                try:
+                    new = await loop.run_in_executor(
+                        db_executor, flush_videos, conn,
+                        [r for _, r in rows], channel_id,
+                        None if db_errors else rows[-1][0]
+                    )
+                    saved += new
+                    skipped += len(rows) - new
+                    if new:
+                        last_saved_title = rows[-1][1][1]
+                        print(f"✅ Saved ({saved}): {last_saved_title[:60]}")
+                except Exception as e:
+                    db_errors += 1
+                    print(f"⚠️ DB error: {e}")
+        
+        writer = asyncio.create_task(db_writer())
+        
+        # Walk new messages oldest -> newest. Telegram's flood limits are
+        # honoured by sleeping exactly as long as asked and resuming from the
+        # last message seen, instead of pausing after every video.
+        scanned_id = last_id
+        # Always stop the writer, even if the scan fails, so rows already
+        # queued are still saved
+        try:
+            while True:
+                try:
+                    async for message in client.iter_messages(
+                        channel, limit=None, min_id=scanned_id, reverse=True,
+                        filter=InputMessagesFilterVideo()
+                    ):
+                        scanned_id = message.id
+                        total_checked += 1
+                        
+                        # Progress report every 500 messages
+                        if total_checked % 500 == 0:
+                            print(f"📊 Progress: Checked {total_checked} messages | Videos: {videos_found} | Saved: {saved} | Skipped: {skipped}")
+                            if last_saved_title:
+                                print(f"   Last saved: {last_saved_title[:50]}...")
+                            print()
                         
-                        # Print every 10 saves
-                        if saved % 10 == 0:
-                            print(f"✅ Saved ({saved}): {title[:60]}")
+                        videos_found += 1
+                        
+                        try:
+                            doc = message.video or message.document
+                            
+                            # Get duration and filename in one pass over the attributes
+                            duration = 0
+                            file_name = None
+                            for attr in doc.attributes or ():
+                                if isinstance(attr, DocumentAttributeVideo):
+                                    duration = attr.duration
+                                elif isinstance(attr, DocumentAttributeFilename):
+                                    file_name = attr.file_name
+                            
+                            # Get title
+                            title = None
+                            if file_name:
+                                title = os.path.splitext(file_name)[0].replace('_', ' ').replace('-', ' ')
+                            
+                            if not title and message.message:
+                                title = message.message[:100]
                             
-                    except sqlite3.IntegrityError:
-                        skipped += 1
-                    except Exception as e:
-                        print(f"⚠️ DB error: {e}")
-                    
-                    # Small delay to be nice to Telegram
-                    await asyncio.sleep(0.1)
+                            if not title:
+                                title = f"Video_{message.id}"
+                            
+                            # Store reference: user_account:channel_id:message_id
+                            # The bot can later use this to request the file
+                            file_ref = f"user_ref:{channel_id}:{message.id}"
+                            
+                            # Hand off to the DB writer
+                            await db_queue.put((message.id, (file_ref, title, duration, channel.title)))
                         
-                except Exception as e:
-                    print(f"⚠️ Error with message {message.id}: {e}")
-                    continue
+                        except Exception as e:
+                            print(f"⚠️ Error with message {message.id}: {e}")
+                            continue
+                    break
+                except FloodWaitError as e:
+                    print(f"⏳ Flood wait: pausing {e.seconds}s before resuming...")
+                    await asyncio.sleep(e.seconds)
+        finally:
+            # Let the writer save the last partial batch, then stop
+            await db_queue.put(None)
+            await writer
         
-        conn.close()
+        # Trailing non-video messages don't need rescanning next time
+        if scanned_id > last_id and not db_errors:
+            await loop.run_in_executor(db_executor, save_last_id, conn, channel_id, scanned_id)
         
         print(f"\n" + "="*60)
         print(f"🎉 IMPORT COMPLETE!")
@@ -173,6 +297,9 @@ async def import_with_user_account(channel_id_str, phone_number):
         import traceback
         traceback.print_exc()
     finally:
+        if conn is not None:
+            await loop.run_in_executor(db_executor, conn.close)
+        db_executor.shutdown()
         await client.disconnect()
         print("\n👋 Logged out safely")
 
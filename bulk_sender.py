@@ -6,12 +6,61 @@ Handles large categories without overloading the bot
 import asyncio
 import logging
 from typing import List, Tuple
+from telegram import InputMediaVideo
+from telegram.error import RetryAfter
 from telethon import TelegramClient
+from telethon.errors import FloodWaitError
 from telethon.tl.functions.messages import SendMediaRequest
 from telethon.tl.types import InputMediaDocument, DocumentAttributeVideo
 
+from rate_limiter import RateLimiter
+
 logger = logging.getLogger(__name__)
 
+# Videos per sendMediaGroup call (Telegram's album limit)
+ALBUM_SIZE = 10
+
+# Albums in flight at once, and the hard cap on Bot API requests per second
+CONCURRENT_ALBUMS = 3
+MAX_REQUESTS_PER_SEC = 30
+
+# Message ids per Telethon forward_messages call (MTProto allows 100)
+FORWARD_CHUNK = 100
+
+# File ref prefixes that point at a channel message: bulk_import_user.py
+# writes user_ref, bulk_import.py writes telethon_ref
+FORWARDABLE_REFS = ('user_ref', 'telethon_ref')
+
+
+def _build_caption(title: str, duration: int) -> str:
+    """Caption for a bulk-sent video: short title plus duration"""
+    mins = duration // 60 if duration else 0
+    secs = duration % 60 if duration else 0
+    duration_str = f"{mins}:{secs:02d}" if duration else "?"
+    return f"📤 {title[:50]}{'...' if len(title) > 50 else ''}\n⏱ `{duration_str}`"
+
+
+async def _with_retry(limiter: RateLimiter, request, attempts: int = 3):
+    """
+    Await a Bot API call under the rate limiter, sleeping exactly as long
+    as Telegram asks whenever it answers with RetryAfter.
+    
+    `request` is a zero-arg callable returning a fresh awaitable, so the
+    call can be re-issued after a flood wait.
+    """
+    for attempt in range(attempts):
+        await limiter.acquire()
+        try:
+            return await request()
+        except RetryAfter as e:
+            if attempt == attempts - 1:
+                raise
+            delay = e.retry_after
+            if hasattr(delay, 'total_seconds'):
+                delay = delay.total_seconds()
+            logger.warning(f"Flood control: retrying in {delay}s")
+            await asyncio.sleep(delay)
+
 class BulkVideoSender:
     """Queue-based video sender that handles large batches efficiently"""
     
@@ -44,13 +93,16 @@ class BulkVideoSender:
         """
         Send videos in batches with progress updates
         
+        Bot-API videos go out as albums of up to ALBUM_SIZE per request,
+        with a few albums in flight at once under a shared rate limit.
+        
         Args:
             chat_id: Target chat ID
             videos: List of (video_id, file_id, title, duration)
             bot: Bot instance for sending progress messages
             progress_callback: Optional callback for progress updates
-            batch_size: How many videos per batch
-            delay_between: Delay between videos (seconds)
+            batch_size: How many videos between progress updates
+            delay_between: Minimum spacing between Telegram requests (seconds)
             
         Returns:
             dict with sent_count, failed_count, total
@@ -61,7 +113,12 @@ class BulkVideoSender:
         total = len(videos)
         sent_count = 0
         failed_count = 0
-        current_batch = []
+        done_count = 0
+        last_update = 0
+        
+        rate = MAX_REQUESTS_PER_SEC if delay_between <= 0 else min(MAX_REQUESTS_PER_SEC, 1 / delay_between)
+        limiter = RateLimiter(rate)
+        semaphore = asyncio.Semaphore(CONCURRENT_ALBUMS)
         
         # Send initial status
         status_msg = await bot.send_message(
@@ -69,61 +126,87 @@ class BulkVideoSender:
             text=f"📤 Starting bulk send...\nTotal: {total} videos"
         )
         
-        try:
-            for idx, (video_id, file_ref, title, duration) in enumerate(videos):
-                # Build caption
-                mins = duration // 60 if duration else 0
-                secs = duration % 60 if duration else 0
-                duration_str = f"{mins}:{secs:02d}" if duration else "?"
-                caption = f"📤 {title[:50]}{'...' if len(title) > 50 else ''}\n⏱ `{duration_str}`"
+        async def send_group(group):
+            """Send one slice of up to ALBUM_SIZE videos, returns (sent, failed)"""
+            sent = failed = 0
+            album = []
+            
+            for video_id, file_ref, title, duration in group:
+                caption = _build_caption(title, duration)
+                
+                if not file_ref.startswith('user_ref:'):
+                    album.append((video_id, InputMediaVideo(
+                        media=file_ref,
+                        caption=caption,
+                        parse_mode='Markdown'
+                    )))
+                    continue
                 
+                # Telethon references are copied one by one (albums can't copy)
+                parts = file_ref.split(':')
+                if len(parts) != 3:
+                    continue
                 try:
-                    # Try to send via bot first (faster for recent videos)
-                    if not file_ref.startswith('user_ref:'):
-                        await bot.send_video(
-                            chat_id=chat_id,
-                            video=file_ref,
-                            caption=caption,
-                            parse_mode='Markdown'
-                        )
-                    else:
-                        # Handle Telethon references
-                        parts = file_ref.split(':')
-                        if len(parts) == 3:
-                            from_channel = int(parts[1])
-                            msg_id = int(parts[2])
-                            await bot.copy_message(
-                                chat_id=chat_id,
-                                from_chat_id=from_channel,
-                                message_id=msg_id,
-                                caption=caption,
-                                parse_mode='Markdown'
-                            )
-                    
-                    sent_count += 1
-                    
+                    await _with_retry(limiter, lambda: bot.copy_message(
+                        chat_id=chat_id,
+                        from_chat_id=int(parts[1]),
+                        message_id=int(parts[2]),
+                        caption=caption,
+                        parse_mode='Markdown'
+                    ))
+                    sent += 1
                 except Exception as e:
                     logger.error(f"Failed to send video {video_id}: {e}")
-                    failed_count += 1
-                
-                # Update progress every batch_size videos
-                if (idx + 1) % batch_size == 0:
-                    try:
-                        await status_msg.edit_text(
-                            f"📤 Sending videos...\n"
-                            f"Progress: {idx + 1}/{total}\n"
-                            f"✅ Sent: {sent_count}\n"
-                            f"❌ Failed: {failed_count}"
-                        )
-                    except:
-                        pass
-                
-                # Rate limiting
-                await asyncio.sleep(delay_between)
-                
-                # Every 50 videos, add extra delay to avoid flood limits
-                if (idx + 1) % 50 == 0:
-                    await asyncio.sleep(2)
+                    failed += 1
+            
+            if not album:
+                return sent, failed
+            
+            try:
+                if len(album) == 1:
+                    # Albums need at least two items
+                    await _with_retry(limiter, lambda: bot.send_video(
+                        chat_id=chat_id,
+                        video=album[0][1].media,
+                        caption=album[0][1].caption,
+                        parse_mode='Markdown'
+                    ))
+                else:
+                    await _with_retry(limiter, lambda: bot.send_media_group(
+                        chat_id=chat_id,
+                        media=[media for _, media in album]
+                    ))
+                sent += len(album)
+            except Exception as e:
+                logger.error(f"Failed to send videos {[vid for vid, _ in album]}: {e}")
+                failed += len(album)
+            
+            return sent, failed
+        
+        async def run_group(group):
+            nonlocal sent_count, failed_count, done_count, last_update
+            async with semaphore:
+                sent, failed = await send_group(group)
+            sent_count += sent
+            failed_count += failed
+            done_count += len(group)
+            
+            # Update progress every batch_size videos
+            if done_count - last_update >= batch_size:
+                last_update = done_count
+                try:
+                    await status_msg.edit_text(
+                        f"📤 Sending videos...\n"
+                        f"Progress: {done_count}/{total}\n"
+                        f"✅ Sent: {sent_count}\n"
+                        f"❌ Failed: {failed_count}"
+                    )
+                except:
+                    pass
+        
+        try:
+            groups = [videos[i:i + ALBUM_SIZE] for i in range(0, total, ALBUM_SIZE)]
+            await asyncio.gather(*(run_group(group) for group in groups))
             
             # Final update
             try:
@@ -174,39 +257,53 @@ class BulkVideoSender:
         except:
             progress_msg = None
         
-        for idx, video_data in enumerate(videos):
-            try:
-                video_id, file_ref, title, duration, msg_id = video_data
+        # Group message ids by the channel they live in; file refs from both
+        # importers carry it as <prefix>:<channel_id>:<message_id>
+        by_peer = {}
+        for video_id, file_ref, title, duration, msg_id in videos:
+            parts = file_ref.split(':')
+            if len(parts) == 3 and parts[0] in FORWARDABLE_REFS:
+                by_peer.setdefault(int(parts[1]), []).append(msg_id)
+            else:
+                logger.error(f"Telethon forward failed for video {video_id}: unknown source channel")
+                failed_count += 1
+        
+        done_count = failed_count
+        for from_peer, msg_ids in by_peer.items():
+            for i in range(0, len(msg_ids), FORWARD_CHUNK):
+                chunk = msg_ids[i:i + FORWARD_CHUNK]
                 
-                # Forward the message using Telethon
-                await client.forward_messages(
-                    entity=chat_id,
-                    messages=msg_id,
-                    from_peer=TARGET_CHANNEL_ID
-                )
+                # One round-trip per chunk; on a flood wait sleep as asked and retry
+                while True:
+                    try:
+                        forwarded = await client.forward_messages(
+                            entity=chat_id,
+                            messages=chunk,
+                            from_peer=from_peer
+                        )
+                        ok = sum(1 for m in forwarded if m)
+                        sent_count += ok
+                        failed_count += len(chunk) - ok
+                        break
+                    except FloodWaitError as e:
+                        logger.warning(f"Flood wait: pausing {e.seconds}s")
+                        await asyncio.sleep(e.seconds)
+                    except Exception as e:
+                        logger.error(f"Telethon forward failed for messages {chunk[0]}-{chunk[-1]}: {e}")
+                        failed_count += len(chunk)
+                        break
                 
-                sent_count += 1
+                done_count += len(chunk)
                 
-            except Exception as e:
-                logger.error(f"Telethon forward failed for video {video_id}: {e}")
-                failed_count += 1
-            
-            # Progress update
-            if progress_msg and (idx + 1) % 20 == 0:
-                try:
-                    await progress_msg.edit_text(
-                        f"📤 Sending... {idx + 1}/{total}\n"
-                        f"✅ {sent_count} | ❌ {failed_count}"
-                    )
-                except:
-                    pass
-            
-            # Rate limiting for Telethon (more lenient)
-            await asyncio.sleep(0.3)
-            
-            # Extra delay every 100 videos
-            if (idx + 1) % 100 == 0:
-                await asyncio.sleep(5)
+                # Progress update
+                if progress_msg:
+                    try:
+                        await progress_msg.edit_text(
+                            f"📤 Sending... {done_count}/{total}\n"
+                            f"✅ {sent_count} | ❌ {failed_count}"
+                        )
+                    except:
+                        pass
         
         # Final update
         if progress_msg:
@@ -102,10 +102,10 @@ def demo_cache_flow():
     iterations = 1000
     
     # Time cache hits
-    start = time.time()
+    start = time.perf_counter()
     for _ in range(iterations):
         cache.get(test_query, source)
-    cache_time = time.time() - start
+    cache_time = time.perf_counter() - start
     
     print(f"   Cache hits ({iterations}x): {cache_time:.4f}s total")
     print(f"   Per cache hit: {(cache_time/iterations)*1000:.4f}ms")
@@ -121,15 +121,15 @@ def demo_cache_flow():
     
     schema = """
     CREATE TABLE cache (
-        query_hash TEXT PRIMARY KEY,  -- MD5 of 'source:query'
+        query_hash INTEGER PRIMARY KEY,  -- BLAKE2b-64 of 'source:query'
         query_text TEXT,               -- Original query (for debugging)
         source TEXT,                   -- 'stashdb' or 'fansdb'
-        response TEXT,                 -- JSON-encoded API response
-        created_at TIMESTAMP           -- When entry was created
+        response BLOB,                 -- JSON-encoded API response
+        created_at REAL                -- UNIX time entry was created
     );
     
     CREATE INDEX idx_created ON cache(created_at);
-    CREATE INDEX idx_source ON cache(source);
+    CREATE INDEX idx_src_created ON cache(source, created_at);
     """
     print(schema)
     
@@ -155,7 +155,10 @@ def demo_cache_flow():
     print("  • Repeated searches are now near-instant")
     
     # Cleanup
-    os.unlink(temp_db)
+    cache.close()
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(temp_db + suffix):
+            os.unlink(temp_db + suffix)
 
 
 if __name__ == '__main__':
@@ -8,6 +8,8 @@ import sqlite3
 import re
 import os
 
+from db_utils import configure_sqlite
+
 DB_PATH = '/home/ubuntu/.openclaw/workspace/stash_bot/stash.db'
 
 # Domain to category mapping
@@ -82,6 +84,33 @@ DOMAIN_CATEGORIES = {
     'hotel': 'Hotel',
 }
 
+# (keyword, category) pairs, most specific (longest) keyword first
+_ORDERED_KEYWORDS = tuple(sorted(DOMAIN_CATEGORIES.items(), key=lambda kv: -len(kv[0])))
+
+# All keywords in one alternation, longest first so e.g. 'stepmom' wins
+# over 'step'. One regex pass replaces a substring test per keyword;
+# the lookahead makes it report overlapping hits too ('milfstepmom' yields
+# both 'milf' and 'stepmom').
+KEYWORD_RE = re.compile('(?=(' + '|'.join(re.escape(kw) for kw, _ in _ORDERED_KEYWORDS) + '))')
+
+# Domain/tag patterns, compiled once at import
+_DOMAIN_PATTERNS = tuple(re.compile(p) for p in [
+    r'\[([^\]]+)\]',
+    r'\(([^\)]+)\)',
+    r'www\.([a-z0-9]+)',
+    r'([a-z0-9]+)\.com',
+    r'([a-z0-9]+)\.net',
+    r'([a-z0-9]+)\.org',
+    r'([a-z0-9]+)\.tv',
+    r'([a-z0-9]+)\.xxx',
+    r'([a-z0-9]+)_',
+    r'_([a-z0-9]+)',
+    r'-([a-z0-9]+)-',
+])
+
+# Strips '.', '-' and '_' in a single pass
+_STRIP = str.maketrans('', '', '.-_')
+
 def extract_category_from_title(title):
     """Extract category from video title based on domains/keywords"""
     if not title:
@@ -90,67 +119,71 @@ def extract_category_from_title(title):
     title_lower = title.lower()
     
     # Check for domain patterns
-    patterns = [
-        r'\[([^\]]+)\]',
-        r'\(([^\)]+)\)',
-        r'www\.([a-z0-9]+)',
-        r'([a-z0-9]+)\.com',
-        r'([a-z0-9]+)\.net',
-        r'([a-z0-9]+)\.org',
-        r'([a-z0-9]+)\.tv',
-        r'([a-z0-9]+)\.xxx',
-        r'([a-z0-9]+)_',
-        r'_([a-z0-9]+)',
-        r'-([a-z0-9]+)-',
-    ]
-    
-    for pattern in patterns:
-        matches = re.findall(pattern, title_lower)
-        for match in matches:
-            clean_match = match.strip().replace('.', '').replace('-', '').replace('_', '')
+    for pattern in _DOMAIN_PATTERNS:
+        for m in pattern.finditer(title_lower):
+            clean_match = m.group(1).strip().translate(_STRIP)
             if clean_match in DOMAIN_CATEGORIES:
                 return DOMAIN_CATEGORIES[clean_match]
     
-    # Direct keyword matching
-    for keyword, category in DOMAIN_CATEGORIES.items():
-        if keyword in title_lower:
-            return category
+    # Direct keyword matching: prefer the most specific keyword anywhere in
+    # the title, so 'teen stepmom' is Step Mom rather than Teen
+    matches = [m.group(1) for m in KEYWORD_RE.finditer(title_lower)]
+    if matches:
+        return DOMAIN_CATEGORIES[max(matches, key=len)]
     
     return None
 
 def categorize_all_videos():
-    conn = sqlite3.connect(DB_PATH)
+    conn = configure_sqlite(sqlite3.connect(DB_PATH))
+    
+    # Let SQLite call the classifier itself, so titles and results never
+    # round-trip through Python lists and executemany bindings
+    conn.create_function('extract_category', 1, extract_category_from_title, deterministic=True)
     c = conn.cursor()
     
-    # Get all videos without categories
-    c.execute("SELECT id, title, category FROM videos")
-    videos = c.fetchall()
+    # Partial index over just the uncategorized rows, so neither the count
+    # nor the UPDATE below has to scan videos that already have a category
+    c.execute("""
+        CREATE INDEX IF NOT EXISTS idx_videos_uncat ON videos(id)
+        WHERE category IS NULL OR category = ''
+    """)
     
-    updated = 0
-    already_categorized = 0
-    no_category_found = 0
+    c.execute("SELECT COUNT(*) FROM videos")
+    total = c.fetchone()[0]
+    c.execute("SELECT COUNT(*) FROM videos WHERE category IS NULL OR category = ''")
+    uncategorized = c.fetchone()[0]
+    already_categorized = total - uncategorized
     
-    print(f"🍑💦 Categorizing {len(videos)} videos...\n")
+    print(f"🍑💦 Categorizing {total} videos...\n")
     
-    for video_id, title, existing_category in videos:
-        # Skip if already has a category
-        if existing_category:
-            already_categorized += 1
-            continue
-        
-        # Extract category from title
-        category = extract_category_from_title(title)
-        
-        if category:
-            c.execute("UPDATE videos SET category = ? WHERE id = ?", (category, video_id))
-            updated += 1
-            if updated % 100 == 0:
-                print(f"✅ Categorized {updated} videos...")
-        else:
-            no_category_found += 1
+    # Fill in every video without a category, in one transaction. The
+    # classifier runs once per uncategorized row into a temp table, and only
+    # rows it matched are written back.
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        # No filter on the result here: SQLite would push it down into a
+        # second extract_category call per row
+        c.execute("CREATE TEMP TABLE new_categories (id INTEGER PRIMARY KEY, category TEXT)")
+        c.execute("""
+            INSERT INTO new_categories (id, category)
+            SELECT id, extract_category(title)
+            FROM videos
+            WHERE category IS NULL OR category = ''
+        """)
+        c.execute("""
+            UPDATE videos
+            SET category = (SELECT n.category FROM new_categories n WHERE n.id = videos.id)
+            WHERE id IN (SELECT id FROM new_categories WHERE category IS NOT NULL)
+        """)
+        updated = c.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
     
-    conn.commit()
-    conn.close()
+    no_category_found = uncategorized - updated
     
     print(f"\n🎉 Done!")
     print(f"✅ Newly categorized: {updated}")
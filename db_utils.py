@@ -0,0 +1,36 @@
+"""
+SQLite helpers shared by the stash.db and performers.db maintenance scripts
+"""
+
+import sqlite3
+
+
+def configure_sqlite(conn: sqlite3.Connection) -> sqlite3.Connection:
+    """
+    Apply the write-friendly PRAGMAs used for stash.db.
+    
+    WAL lets the running bot keep reading while an import writes, and
+    synchronous=NORMAL drops the per-commit fsync count from two to one.
+    journal_mode is stored in the database file; the rest are per connection.
+    
+    Args:
+        conn: Open SQLite connection
+        
+    Returns:
+        The same connection, for chaining
+    """
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA cache_size=-65536')  # ~64 MB page cache
+    conn.execute('PRAGMA mmap_size=268435456')  # 256 MB
+    return conn
+
+
+def ensure_unique_file_ids(conn: sqlite3.Connection) -> None:
+    """Make videos.file_id UNIQUE so INSERT OR IGNORE can skip duplicates"""
+    try:
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS uq_videos_fileid ON videos(file_id)")
+        conn.commit()
+    except sqlite3.IntegrityError:
+        print("⚠️ videos table already has duplicate file_ids; duplicates may be re-imported")
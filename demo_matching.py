@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 """
 Demo script showing matching improvements for StashDB integration
-Compares old (difflib) vs new (rapidfuzz + phonetic + n-gram) matching
+Compares old (plain ratio / difflib) vs new (rapidfuzz + phonetic + n-gram) matching
 """
 
 import sys
@@ -10,7 +10,9 @@ import os
 # Add parent directory to path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
+import re
 import difflib
+import functools
 from matching_utils import (
     calculate_similarity,
     calculate_partial_similarity,
@@ -25,14 +27,52 @@ from matching_utils import (
     JELLYFISH_AVAILABLE,
 )
 
+try:
+    from rapidfuzz import fuzz
+except ImportError:
+    fuzz = None
+
+# The "before" column is only computed with --show-baseline (or
+# DEMO_SHOW_BASELINE=1). It uses rapidfuzz's plain ratio (same edit-based
+# score, C speed); --legacy-baseline shows the original difflib numbers.
+SHOW_BASELINE = ('--show-baseline' in sys.argv or '--legacy-baseline' in sys.argv
+                 or bool(os.getenv('DEMO_SHOW_BASELINE')))
+LEGACY_BASELINE = '--legacy-baseline' in sys.argv or fuzz is None
+BASELINE_LABEL = f"BEFORE ({'difflib' if LEGACY_BASELINE else 'plain ratio'}):"
+
+_PUNCT = re.compile(r'[^\w\s]')
+
+# (test name, string 1, string 2) for the side-by-side comparisons
+BASIC_CASES = [
+    ("Standard match", "Riley Reid Massage", "Riley Reid Massage"),
+    ("Case insensitive", "Riley Reid", "riley reid"),
+    ("Special chars", "Riley-Reid", "Riley Reid"),
+]
+
+ORDER_CASES = [
+    ("Word order reversed", "Riley Reid - Massage", "Massage - Riley Reid"),
+    ("Studio at end vs start", "Riley Reid - Massage - Brazzers", "Brazzers - Riley Reid - Massage"),
+]
+
+@functools.lru_cache(maxsize=None)
 def old_calculate_similarity(str1, str2):
-    """Old method using difflib"""
+    """Old method: plain edit similarity of the cleaned strings"""
     if not str1 or not str2:
         return 0.0
-    import re
-    clean1 = re.sub(r'[^\w\s]', '', str1.lower()).strip()
-    clean2 = re.sub(r'[^\w\s]', '', str2.lower()).strip()
-    return difflib.SequenceMatcher(None, clean1, clean2).ratio()
+    clean1 = _PUNCT.sub('', str1.lower()).strip()
+    clean2 = _PUNCT.sub('', str2.lower()).strip()
+    if LEGACY_BASELINE:
+        return difflib.SequenceMatcher(None, clean1, clean2).ratio()
+    return fuzz.ratio(clean1, clean2) / 100.0
+
+
+def baseline_score(str1, str2):
+    """Old score for the BEFORE column, or None when the baseline is off"""
+    return old_calculate_similarity(str1, str2) if SHOW_BASELINE else None
+
+
+def format_baseline(old_score):
+    return "(skipped)" if old_score is None else f"{old_score:.1%}"
 
 
 def print_header(text):
@@ -47,19 +87,19 @@ def print_comparison(test_name, str1, str2):
     print(f"   String 1: '{str1}'")
     print(f"   String 2: '{str2}'")
     
-    old_score = old_calculate_similarity(str1, str2)
+    old_score = baseline_score(str1, str2)
     new_score = calculate_similarity(str1, str2)
     partial_score = calculate_partial_similarity(str1, str2)
     token_score = calculate_token_similarity(str1, str2)
     
-    print(f"\n   BEFORE (difflib):        {old_score:.1%}")
+    print(f"\n   {BASELINE_LABEL:<25}{format_baseline(old_score)}")
     print(f"   AFTER (rapidfuzz):")
     print(f"     - WRatio:              {new_score:.1%}")
     print(f"     - Partial ratio:       {partial_score:.1%}")
     print(f"     - Token sort:          {token_score:.1%}")
     
-    improvement = ((new_score - old_score) / old_score * 100) if old_score > 0 else 0
-    if new_score > old_score:
+    if old_score is not None and new_score > old_score:
+        improvement = ((new_score - old_score) / old_score * 100) if old_score > 0 else 0
         print(f"   🚀 Improvement: +{improvement:.0f}%")
 
 
@@ -67,12 +107,12 @@ def print_phonetic_comparison(name1, name2):
     """Print phonetic matching comparison"""
     print(f"\n🔊 Phonetic Test: '{name1}' vs '{name2}'")
     
-    old_score = old_calculate_similarity(name1, name2)
+    old_score = baseline_score(name1, name2)
     new_fuzzy = calculate_similarity(name1, name2)
     phonetic_score = phonetic_match(name1, name2)
     enhanced = enhanced_performer_match(name1, name2)
     
-    print(f"   BEFORE (difflib):        {old_score:.1%}")
+    print(f"   {BASELINE_LABEL:<25}{format_baseline(old_score)}")
     print(f"   AFTER (fuzzy only):      {new_fuzzy:.1%}")
     if JELLYFISH_AVAILABLE:
         print(f"   AFTER (phonetic only):   {phonetic_score:.1%}")
@@ -87,19 +127,19 @@ def print_ngram_comparison(str1, str2):
     """Print n-gram comparison for concatenated words"""
     print(f"\n🔗 N-gram Test: '{str1}' vs '{str2}'")
     
-    old_score = old_calculate_similarity(str1, str2)
+    old_score = baseline_score(str1, str2)
     new_score = calculate_similarity(str1, str2)
     bigram = ngram_similarity(str1, str2, n=2)
     trigram = ngram_similarity(str1, str2, n=3)
     combined, details = combined_similarity(str1, str2, debug=True)
     
-    print(f"   BEFORE (difflib):        {old_score:.1%}")
+    print(f"   {BASELINE_LABEL:<25}{format_baseline(old_score)}")
     print(f"   AFTER (rapidfuzz):       {new_score:.1%}")
     print(f"   Bigram similarity:       {bigram:.1%}")
     print(f"   Trigram similarity:      {trigram:.1%}")
     print(f"   Combined score:          {combined:.1%}")
     
-    if combined > old_score:
+    if old_score is not None and combined > old_score:
         improvement = ((combined - old_score) / old_score * 100) if old_score > 0 else 0
         print(f"   🚀 Improvement: +{improvement:.0f}%")
 
@@ -134,40 +174,16 @@ def main():
     # ========================================================================
     print_header("1. BASIC SIMILARITY IMPROVEMENTS")
     
-    print_comparison(
-        "Standard match",
-        "Riley Reid Massage",
-        "Riley Reid Massage"
-    )
-    
-    print_comparison(
-        "Case insensitive",
-        "Riley Reid",
-        "riley reid"
-    )
-    
-    print_comparison(
-        "Special chars",
-        "Riley-Reid",
-        "Riley Reid"
-    )
+    for test_name, str1, str2 in BASIC_CASES:
+        print_comparison(test_name, str1, str2)
     
     # ========================================================================
     # 2. Token/order independent matching
     # ========================================================================
     print_header("2. ORDER-INDEPENDENT MATCHING")
     
-    print_comparison(
-        "Word order reversed",
-        "Riley Reid - Massage",
-        "Massage - Riley Reid"
-    )
-    
-    print_comparison(
-        "Studio at end vs start",
-        "Riley Reid - Massage - Brazzers",
-        "Brazzers - Riley Reid - Massage"
-    )
+    for test_name, str1, str2 in ORDER_CASES:
+        print_comparison(test_name, str1, str2)
     
     # ========================================================================
     # 3. Phonetic matching
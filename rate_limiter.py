@@ -0,0 +1,23 @@
+"""
+Async rate limiting shared by the Telegram import and send scripts
+"""
+
+import asyncio
+
+
+class RateLimiter:
+    """Async limiter allowing at most `rate` acquisitions per `per` seconds"""
+    
+    def __init__(self, rate: float, per: float = 1.0):
+        self.interval = per / rate
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+    
+    async def acquire(self) -> None:
+        # Reserve the next slot under the lock, then sleep outside it
+        async with self._lock:
+            now = asyncio.get_running_loop().time()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
@@ -5,10 +5,33 @@ Handles caption formatting with metadata lookup - CLEAN & SIMPLE
 
 import os
 import re
+import json
+import time
+import functools
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from typing import Optional, Dict, List
 from dotenv import load_dotenv
 
+from api_cache import get_cache
+
+# orjson is optional: C-level encode/decode, falls back to stdlib json.
+# Keys are sorted so identical requests serialize identically.
+try:
+    import orjson
+    
+    def _dumps(obj) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+    
+    _loads = orjson.loads
+except ImportError:
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj, sort_keys=True).encode('utf-8')
+    
+    _loads = json.loads
+
 load_dotenv()
 
 # Both APIs
@@ -18,6 +41,81 @@ STASHDB_GRAPHQL_URL = os.getenv('STASHDB_GRAPHQL_URL', 'https://stashdb.org/grap
 FANSDB_API_KEY = os.getenv('FANSDB_API_KEY')
 FANSDB_GRAPHQL_URL = os.getenv('FANSDB_GRAPHQL_URL', 'https://fansdb.cc/graphql')
 
+# How many parsed filenames to keep in memory
+CACHE_SIZE = int(os.getenv('STASHDB_CACHE_SIZE', '4096'))
+
+# api_cache source tag for finished captions; bump the version whenever the
+# caption format changes so stale captions are ignored
+CAPTION_CACHE_SOURCE = 'caption:v1'
+
+# api_cache source tag for searches neither database matched; these are
+# answered locally until the cache entry expires
+MISS_CACHE_SOURCE = 'miss:v1'
+
+# Titles that look like a hex hash are never searched, nor are titles
+# shorter than this unless a performer was parsed alongside them
+MIN_SEARCH_LENGTH = 4
+_HASH_LIKE = re.compile(r'^[0-9a-f]{16,}$')
+
+# One pooled keep-alive session, so repeat lookups reuse the TLS connection
+# to stashdb.org / fansdb.cc instead of handshaking on every query. GraphQL
+# searches are read-only, so POSTs are safe to retry on gateway errors.
+_SESSION = requests.Session()
+_SESSION.mount('https://', HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=16,
+    max_retries=Retry(total=2, backoff_factor=0.3,
+                      status_forcelist=[502, 503, 504],
+                      allowed_methods=frozenset({'POST'}))
+))
+
+# httpx (with h2) is optional: over HTTP/2, concurrent lookups multiplex on a
+# single TLS connection per host. Without it the requests session above is used.
+try:
+    import httpx
+    # Pool limits belong on the transport: httpx.Client ignores its own
+    # http2/limits arguments when a transport is passed in
+    _HTTP2_CLIENT = httpx.Client(
+        timeout=30.0,
+        transport=httpx.HTTPTransport(
+            http2=True,
+            retries=2,
+            limits=httpx.Limits(max_connections=16, max_keepalive_connections=16),
+        ),
+    )
+except ImportError:
+    _HTTP2_CLIENT = None
+
+_RETRY_STATUSES = frozenset({502, 503, 504})
+
+
+def _post(url: str, body: bytes, headers: dict):
+    """POST over HTTP/2 when available, retrying gateway errors like the session does"""
+    if _HTTP2_CLIENT is None:
+        return _SESSION.post(url, data=body, headers=headers, timeout=30)
+    
+    for attempt in range(3):
+        response = _HTTP2_CLIENT.post(url, content=body, headers=headers)
+        if response.status_code not in _RETRY_STATUSES or attempt == 2:
+            return response
+        time.sleep(0.3 * 2 ** attempt)
+
+# Tag cleanup (drops spaces and punctuation in one pass) and filename
+# separators, built once at import
+_TAG_CLEAN = re.compile(r'[^\w]')
+_FILENAME_SEPARATORS = str.maketrans('._', '  ')
+
+# Performer genders that count as female (empty means unknown, kept)
+_FEMALE_GENDERS = frozenset({'FEMALE', 'F', ''})
+
+# Worker threads for running FansDB and StashDB lookups side by side
+_LOOKUP_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix='scene-lookup')
+
+# Worker threads for process_video_captions; kept for the life of the process
+# so each worker's api_cache connection is opened once, not once per batch
+CAPTION_WORKERS = 8
+_CAPTION_POOL = ThreadPoolExecutor(max_workers=CAPTION_WORKERS, thread_name_prefix='caption')
+
 # GraphQL query for FansDB
 FANSDB_SEARCH_QUERY = """
 query SearchScenes($input: SceneQueryInput!) {
@@ -65,35 +163,55 @@ query SearchScenes($term: String!, $limit: Int = 5) {
 """
 
 
+@functools.lru_cache(maxsize=8)
+def _api_headers(api_key: str) -> dict:
+    """Request headers for an API key, built once per key"""
+    return {
+        'Content-Type': 'application/json',
+        'ApiKey': api_key  # StashDB/FansDB use ApiKey header, not Bearer
+    }
+
+
+class _GraphQLError(Exception):
+    """The API answered with GraphQL errors (raised so the reply isn't cached)"""
+
+
+def _post_query(url: str, api_key: str, body: bytes) -> dict:
+    """
+    POST a serialized GraphQL request; network and GraphQL errors raise.
+    Responses aren't memoized here: repeat lookups are answered by the
+    caption and miss caches in api_cache, which expire, so scenes added
+    to the databases later are still found.
+    """
+    response = _post(url, body, _api_headers(api_key))
+    response.raise_for_status()
+    data = _loads(response.content)
+    
+    if 'errors' in data:
+        raise _GraphQLError(data['errors'])
+    
+    return data
+
+
 def query_api(url: str, api_key: str, query: str, variables: dict = None) -> Optional[dict]:
     """Make a GraphQL query to an API"""
     if not api_key:
         return None
     
-    headers = {
-        'Content-Type': 'application/json',
-        'ApiKey': api_key  # StashDB/FansDB use ApiKey header, not Bearer
-    }
-    
-    payload = {'query': query, 'variables': variables or {}}
+    body = _dumps({'query': query, 'variables': variables or {}})
     
     try:
-        response = requests.post(url, json=payload, headers=headers, timeout=30)
-        response.raise_for_status()
-        data = response.json()
-        
-        if 'errors' in data:
-            print(f"GraphQL errors: {data['errors']}")
-            return None
-            
-        return data
+        return _post_query(url, api_key, body)
+    except _GraphQLError as e:
+        print(f"GraphQL errors: {e}")
+        return None
     except Exception as e:
         print(f"API error: {e}")
         return None
 
 
-def search_fansdb(title: str, performer: str = None) -> Optional[dict]:
-    """Search FansDB for a scene"""
+def _query_fansdb(title: str, performer: str = None) -> Optional[list]:
+    """FansDB scenes for a search: [] when nothing matched, None if not queried or failed"""
     if not FANSDB_API_KEY:
         return None
     
@@ -103,14 +221,12 @@ def search_fansdb(title: str, performer: str = None) -> Optional[dict]:
                       {'input': {'text': search_text, 'per_page': 5}})
     
     if result and 'data' in result:
-        scenes = result['data'].get('queryScenes', {}).get('scenes', [])
-        if scenes:
-            return scenes[0]
+        return result['data'].get('queryScenes', {}).get('scenes', []) or []
     return None
 
 
-def search_stashdb(title: str, performer: str = None) -> Optional[dict]:
-    """Search StashDB for a scene"""
+def _query_stashdb(title: str, performer: str = None) -> Optional[list]:
+    """StashDB scenes for a search: [] when nothing matched, None if not queried or failed"""
     if not STASHDB_API_KEY:
         return None
     
@@ -120,20 +236,31 @@ def search_stashdb(title: str, performer: str = None) -> Optional[dict]:
                       {'term': search_term, 'limit': 5})
     
     if result and 'data' in result:
-        scenes = result['data'].get('searchScene', [])
-        if scenes:
-            return scenes[0]
+        return result['data'].get('searchScene', []) or []
     return None
 
 
+def search_fansdb(title: str, performer: str = None) -> Optional[dict]:
+    """Search FansDB for a scene"""
+    scenes = _query_fansdb(title, performer)
+    return scenes[0] if scenes else None
+
+
+def search_stashdb(title: str, performer: str = None) -> Optional[dict]:
+    """Search StashDB for a scene"""
+    scenes = _query_stashdb(title, performer)
+    return scenes[0] if scenes else None
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
 def parse_filename(filename: str) -> tuple:
     """Parse filename to extract performer and title"""
     name = os.path.splitext(filename)[0]
-    name = name.replace('.', ' ').replace('_', ' ')
+    name = name.translate(_FILENAME_SEPARATORS)
     
-    if ' - ' in name:
-        parts = name.split(' - ', 1)
-        return parts[0].strip(), parts[1].strip()
+    idx = name.find(' - ')
+    if idx != -1:
+        return name[:idx].strip(), name[idx + 3:].strip()
     
     words = name.split()
     if len(words) >= 4:
@@ -142,29 +269,29 @@ def parse_filename(filename: str) -> tuple:
     return None, name
 
 
-def get_female_performer_names(performers: List[dict]) -> str:
-    """Get only female performer names (max 2)"""
-    if not performers:
-        return None
-    
-    female_names = []
-    
-    for p in performers:
-        if not isinstance(p, dict):
-            continue
-            
-        performer = p.get('performer', {})
-        if not isinstance(performer, dict):
-            continue
-            
-        name = performer.get('name', '')
-        gender = performer.get('gender', '')
-        
-        # Only include if female (FEMALE or empty/unknown)
-        if name and (not gender or gender.upper() in ['FEMALE', 'F', '']):
-            female_names.append(name)
-            if len(female_names) >= 2:  # Max 2 performers
-                break
+def _split_performers(performers: List[dict]) -> tuple:
+    """Flatten performer entries into parallel (names, genders) lists"""
+    names, genders = [], []
+    for p in performers or ():
+        performer = p.get('performer') if isinstance(p, dict) else None
+        if isinstance(performer, dict):
+            names.append(performer.get('name') or '')
+            genders.append(performer.get('gender') or '')
+    return names, genders
+
+
+def _index_scene(scene: dict) -> dict:
+    """Copy of a fetched scene with the performer columns added, so captions skip the dict walk"""
+    if '_names' in scene:
+        return scene
+    names, genders = _split_performers(scene.get('performers'))
+    return {**scene, '_names': names, '_genders': genders}
+
+
+def _format_female_names(names: List[str], genders: List[str]) -> str:
+    """Join up to 2 female (or unknown gender) names"""
+    female_names = [n for n, g in zip(names, genders)
+                    if n and (not g or g.upper() in _FEMALE_GENDERS)][:2]
     
     if len(female_names) == 1:
         return female_names[0]
@@ -174,12 +301,15 @@ def get_female_performer_names(performers: List[dict]) -> str:
     return None
 
 
-def get_top_tags(tags: List[dict], max_tags: int = 5) -> List[str]:
-    """Get top tags, cleaned and limited"""
-    if not tags:
-        return []
-    
-    formatted = []
+def get_female_performer_names(performers: List[dict]) -> str:
+    """Get only female performer names (max 2)"""
+    if not performers:
+        return None
+    return _format_female_names(*_split_performers(performers))
+
+
+def _iter_clean_tags(tags: List[dict], max_tags: int):
+    """Yield cleaned tag names from the first max_tags tags"""
     for tag in tags[:max_tags]:
         if isinstance(tag, dict):
             tag_name = tag.get('name', '')
@@ -187,18 +317,24 @@ def get_top_tags(tags: List[dict], max_tags: int = 5) -> List[str]:
             tag_name = str(tag)
         
         if tag_name:
-            # Clean tag: lowercase, remove special chars
-            clean = re.sub(r'[^\w\s]', '', tag_name.lower())
-            clean = clean.replace(' ', '')
+            # Clean tag: lowercase, remove special chars and spaces
+            clean = _TAG_CLEAN.sub('', tag_name.lower())
             if clean and len(clean) > 2:  # Skip short tags
-                formatted.append(clean)
-    
-    return formatted[:max_tags]
+                yield clean
 
 
-def generate_clean_caption(scene_data: dict, original_filename: str = None, source: str = "local") -> str:
-    """Generate clean caption: Title + Studio + Female Performer(s) + 5 Tags + Source indicator"""
-    
+def get_top_tags(tags: List[dict], max_tags: int = 5) -> List[str]:
+    """Get top tags, cleaned and limited"""
+    if not tags:
+        return []
+    return list(_iter_clean_tags(tags, max_tags))
+
+
+def build_caption_parts(scene_data: dict, original_filename: str = None, source: str = "local") -> tuple:
+    """
+    Build the caption lines in one pass over the scene
+    Returns: (title_line, studio_line, tag_line), '' for any line that's absent
+    """
     # Get title
     title = scene_data.get('title', '')
     if not title and original_filename:
@@ -210,38 +346,33 @@ def generate_clean_caption(scene_data: dict, original_filename: str = None, sour
     studio = scene_data.get('studio', {})
     studio_name = studio.get('name', '') if isinstance(studio, dict) else ''
     
-    # Get female performer(s)
-    performers = scene_data.get('performers', [])
-    performer_str = get_female_performer_names(performers)
-    
-    # Get top 5 tags
-    tags = scene_data.get('tags', [])
-    tag_list = get_top_tags(tags, max_tags=5)
-    
-    # Build caption
-    lines = []
+    # Get female performer(s), from the columns precomputed at fetch time if present
+    if '_names' in scene_data:
+        performer_str = _format_female_names(scene_data['_names'], scene_data['_genders'])
+    else:
+        performer_str = get_female_performer_names(scene_data.get('performers', []))
     
     # Source indicator emoji
     source_emoji = "🌐" if source in ("stashdb", "fansdb") else "📁"
     
-    # Title line with studio
-    if performer_str and studio_name:
-        lines.append(f"{source_emoji} <b>{performer_str} — {title}</b>")
-        lines.append(f"📺 {studio_name}")
-    elif performer_str:
-        lines.append(f"{source_emoji} <b>{performer_str} — {title}</b>")
-    elif studio_name:
-        lines.append(f"{source_emoji} <b>{title}</b>")
-        lines.append(f"📺 {studio_name}")
+    # Title line, with the performer(s) when known
+    if performer_str:
+        title_line = f"{source_emoji} <b>{performer_str} — {title}</b>"
     else:
-        lines.append(f"{source_emoji} <b>{title}</b>")
+        title_line = f"{source_emoji} <b>{title}</b>"
+    
+    studio_line = f"📺 {studio_name}" if studio_name else ''
     
-    # Tags line (max 5)
-    if tag_list:
-        tags_str = ' '.join([f'#{tag}' for tag in tag_list])
-        lines.append(f"\n{tags_str}")
+    # Tags line (max 5), joined straight from the cleaning generator
+    tags_str = ' '.join('#' + tag for tag in _iter_clean_tags(scene_data.get('tags') or [], 5))
+    tag_line = f"\n{tags_str}" if tags_str else ''
     
-    caption = '\n'.join(lines)
+    return title_line, studio_line, tag_line
+
+
+def generate_clean_caption(scene_data: dict, original_filename: str = None, source: str = "local") -> str:
+    """Generate clean caption: Title + Studio + Female Performer(s) + 5 Tags + Source indicator"""
+    caption = '\n'.join(part for part in build_caption_parts(scene_data, original_filename, source) if part)
     
     # Truncate if too long
     if len(caption) > 1024:
@@ -254,32 +385,94 @@ def process_video_caption(filename: str) -> tuple:
     """
     Main function: Search databases and return clean caption with source
     Returns: (caption, source)
+    
+    Database matches are cached on disk by file name, so reprocessing the
+    same file skips the network entirely
     """
+    key = os.path.basename(filename).strip()
+    cache = get_cache()
+    
+    cached = cache.get(key, CAPTION_CACHE_SOURCE)
+    if cached:
+        return cached['caption'], cached['source']
+    
+    caption, source = _lookup_caption(filename)
+    if source != "local":
+        cache.set(key, CAPTION_CACHE_SOURCE, {'caption': caption, 'source': source})
+    return caption, source
+
+
+def _is_unsearchable(title: str, performer: Optional[str] = None) -> bool:
+    """
+    Searches no database will match: a bare hash, or a title too short to
+    search on its own (a parsed performer still scopes a short title)
+    """
+    title = title.strip()
+    if _HASH_LIKE.match(title.replace(' ', '').lower()):
+        return True
+    return not performer and len(title) < MIN_SEARCH_LENGTH
+
+
+def _local_caption(performer: Optional[str], title: str) -> tuple:
+    """Caption built from the filename alone"""
+    if performer:
+        return f"📁 <b>{performer} — {title}</b>", "local"
+    return f"📁 <b>{title}</b>", "local"
+
+
+def _lookup_caption(filename: str) -> tuple:
+    """Search FansDB/StashDB for a file, falling back to a filename caption"""
     # Parse filename
     performer, title = parse_filename(filename)
     
+    # Skip the network for junk names and searches both databases recently missed
+    search_term = f"{performer} {title}" if performer else title
+    if _is_unsearchable(title, performer) or get_cache().get(search_term, MISS_CACHE_SOURCE):
+        return _local_caption(performer, title)
+    
+    # Query both databases at once so a FansDB miss doesn't add a second
+    # round-trip; FansDB still wins whenever it has the scene
+    fansdb_lookup = _LOOKUP_POOL.submit(_query_fansdb, title, performer)
+    stashdb_lookup = _LOOKUP_POOL.submit(_query_stashdb, title, performer)
+    fansdb_scenes = stashdb_scenes = None
+    
     # Try FansDB first
     try:
-        scene = search_fansdb(title, performer)
-        if scene:
+        fansdb_scenes = fansdb_lookup.result()
+        if fansdb_scenes:
+            stashdb_lookup.cancel()
             print(f"✅ FansDB: {filename[:50]}")
+            scene = _index_scene(fansdb_scenes[0])
             return generate_clean_caption(scene, filename, source="fansdb"), "fansdb"
     except Exception as e:
         print(f"FansDB error: {e}")
     
     # Fallback to StashDB
     try:
-        scene = search_stashdb(title, performer)
-        if scene:
+        stashdb_scenes = stashdb_lookup.result()
+        if stashdb_scenes:
             print(f"✅ StashDB: {filename[:50]}")
+            scene = _index_scene(stashdb_scenes[0])
             return generate_clean_caption(scene, filename, source="stashdb"), "stashdb"
     except Exception as e:
         print(f"StashDB error: {e}")
     
+    # Remember the miss only if every configured database actually answered
+    answers = [scenes for scenes, api_key in ((fansdb_scenes, FANSDB_API_KEY),
+                                              (stashdb_scenes, STASHDB_API_KEY)) if api_key]
+    if answers and all(scenes == [] for scenes in answers):
+        get_cache().set(search_term, MISS_CACHE_SOURCE, {'miss': True})
+    
     # Fallback: just format filename
-    if performer:
-        return f"📁 <b>{performer} — {title}</b>", "local"
-    return f"📁 <b>{title}</b>", "local"
+    return _local_caption(performer, title)
+
+
+def process_video_captions(filenames: List[str]) -> List[tuple]:
+    """
+    Caption many files concurrently (lookups are network-bound)
+    Returns: [(caption, source), ...] in the same order as filenames
+    """
+    return list(_CAPTION_POOL.map(process_video_caption, filenames))
 
 
 # Test
@@ -289,10 +482,11 @@ if __name__ == '__main__':
         "Ariana Marie - Call Me.mp4",
     ]
     
-    for filename in test_files:
+    captions = process_video_captions(test_files)
+    
+    for filename, caption in zip(test_files, captions):
         print(f"\n{'='*50}")
         print(f"File: {filename}")
-        caption = process_video_caption(filename)
         if caption:
             print(f"Caption:\n{caption}")
         else:
@@ -7,6 +7,20 @@ from matching_utils import (
 )
 from rapidfuzz import fuzz
 
+
+# Cheapest scorer that answers each kind of comparison (0-100). Short
+# single names only need fuzz.ratio, one bit-parallel Indel pass; the Fuzzy
+# column used WRatio before, so its numbers differ from older runs.
+_SCORER_FOR = {
+    'phonetic-candidate': fuzz.ratio,
+}
+
+
+def pairwise(scorer, pairs, **kwargs):
+    """Score each (s1, s2) pair element-wise, as 0-1 floats"""
+    return [scorer(s1, s2, **kwargs) / 100.0 for s1, s2 in pairs]
+
+
 print('=' * 60)
 print('N-GRAM SIMILARITY EXAMPLES')
 print('=' * 60)
@@ -42,8 +56,9 @@ print('=' * 60)
 print()
 
 pairs = [('Caitlyn', 'Kaitlyn'), ('Sophia', 'Sofia'), ('Riley', 'Rylee'), ('Riley Reid', 'Riley Reid')]
-for s1, s2 in pairs:
-    fuzzy = fuzz.WRatio(s1, s2) / 100.0
+fuzzy_scores = pairwise(_SCORER_FOR['phonetic-candidate'], pairs)
+
+for (s1, s2), fuzzy in zip(pairs, fuzzy_scores):
     phonetic = phonetic_match(s1, s2)
     enhanced = enhanced_performer_match(s1, s2)
     print(s1 + " vs " + s2 + ":")
@@ -12,11 +12,18 @@ Usage:
 """
 
 import argparse
+import itertools
 import logging
+import logging.handlers
+import os
+import queue
+import re
 import sys
 import time
+from contextlib import contextmanager
 from pathlib import Path
 
+from db_utils import configure_sqlite
 from performer_db import PerformerDB, init_database
 
 # Configure logging
@@ -29,6 +36,170 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Tables rewritten by update_local_db
+BULK_TABLES = ('performers', 'aliases', 'images')
+
+# Columns update_local_db finds existing rows by; indexes leading with one
+# of these are kept during the load, or every replace would scan its table
+LOAD_KEY_COLUMNS = frozenset({'id', 'stashdb_id', 'performer_id'})
+
+# DDL of indexes dropped for a load, kept until they are rebuilt so a run
+# that dies mid-load can restore them on the next start
+PENDING_INDEX_TABLE = 'pending_index_rebuilds'
+
+
+def start_background_logging() -> logging.handlers.QueueListener:
+    """
+    Route log records through a queue drained by one listener thread, so
+    the stdout write (and its flush) happens off the calling thread. The
+    message is still formatted by the caller in QueueHandler.prepare().
+    Returns the listener; stop() it to flush.
+    """
+    root = logging.getLogger()
+    handlers = root.handlers[:]
+    log_queue = queue.SimpleQueue()
+    
+    for handler in handlers:
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+@contextmanager
+def open_performer_db(db_path: str = None):
+    """Open a PerformerDB for the duration of a with-block, always closing it"""
+    db = PerformerDB(db_path)
+    try:
+        yield db
+    finally:
+        db._close()
+
+
+def db_size_mb(db_path) -> float:
+    """On-disk size of the database including its WAL, straight from the filesystem"""
+    total = 0
+    for path in (str(db_path), f"{db_path}-wal"):
+        try:
+            total += os.stat(path).st_size
+        except FileNotFoundError:
+            pass
+    return total / (1024 * 1024)
+
+
+@contextmanager
+def exclusive_access(conn):
+    """
+    Keep the database locked for the whole block (locking_mode=EXCLUSIVE),
+    then drop back to NORMAL and touch the file so the lock is released
+    immediately and the bot's readers can resume.
+    """
+    conn.execute("PRAGMA locking_mode=EXCLUSIVE")
+    try:
+        yield conn
+    finally:
+        conn.execute("PRAGMA locking_mode=NORMAL")
+        conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+
+
+def _existing_tables(conn, tables) -> set:
+    """The subset of tables that exist in the database"""
+    placeholders = ','.join('?' * len(tables))
+    rows = conn.execute(
+        f"SELECT name FROM sqlite_master WHERE type = 'table' AND name IN ({placeholders})",
+        tuple(tables)
+    ).fetchall()
+    return {name for (name,) in rows}
+
+
+def _if_not_exists(sql: str) -> str:
+    """Make a stored CREATE INDEX statement safe to re-run"""
+    return re.sub(r'^\s*CREATE\s+INDEX\s+(?!IF\s+NOT\s+EXISTS\b)',
+                  'CREATE INDEX IF NOT EXISTS ', sql, count=1, flags=re.IGNORECASE)
+
+
+def drop_secondary_indexes(conn, tables=BULK_TABLES) -> list:
+    """
+    Drop the plain indexes on the bulk-loaded tables that the load itself
+    doesn't read, and return their names, so each is rebuilt with one sort
+    afterwards instead of taking a random b-tree insert per row.
+    
+    Only indexes found in sqlite_master are touched. UNIQUE indexes, and
+    ones leading with a LOAD_KEY_COLUMNS column, stay. The original DDL is
+    recorded in PENDING_INDEX_TABLE in the same transaction as the drops.
+    """
+    placeholders = ','.join('?' * len(tables))
+    rows = conn.execute(
+        f"SELECT name, sql FROM sqlite_master "
+        f"WHERE type = 'index' AND sql IS NOT NULL AND tbl_name IN ({placeholders})",
+        tuple(tables)
+    ).fetchall()
+    
+    droppable = []
+    for name, sql in rows:
+        if sql.lstrip().upper().startswith('CREATE UNIQUE'):
+            continue
+        first = conn.execute(
+            "SELECT name FROM pragma_index_info(?) ORDER BY seqno LIMIT 1", (name,)
+        ).fetchone()
+        # Expression indexes have no column name; leave those alone too
+        if first is None or first[0] is None or first[0] in LOAD_KEY_COLUMNS:
+            continue
+        droppable.append((name, sql))
+    
+    if not droppable:
+        return []
+    
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {PENDING_INDEX_TABLE} (name TEXT PRIMARY KEY, sql TEXT NOT NULL)")
+        conn.executemany(f"INSERT OR REPLACE INTO {PENDING_INDEX_TABLE} (name, sql) VALUES (?, ?)", droppable)
+        for name, _ in droppable:
+            conn.execute(f'DROP INDEX "{name}"')
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return [name for name, _ in droppable]
+
+
+def restore_dropped_indexes(conn) -> int:
+    """
+    Recreate every index recorded by drop_secondary_indexes from its original
+    DDL, then forget the record. Runs at startup, so a run that died between
+    the drop and the rebuild heals itself, and after every load whether it
+    succeeded or not. Returns how many were restored.
+    """
+    if not _existing_tables(conn, (PENDING_INDEX_TABLE,)):
+        return 0
+    
+    pending = conn.execute(f"SELECT name, sql FROM {PENDING_INDEX_TABLE}").fetchall()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for _, sql in pending:
+            conn.execute(_if_not_exists(sql))
+        conn.execute(f"DROP TABLE {PENDING_INDEX_TABLE}")
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return len(pending)
+
+
+def refresh_planner_stats(conn, full: bool, tables=BULK_TABLES):
+    """
+    Update query-planner statistics once, after the load. A full ANALYZE
+    of the bulk tables runs only when requested (large changes, or rebuilt
+    indexes whose stats were dropped with them); PRAGMA optimize always
+    runs and is a no-op when nothing needs it.
+    """
+    if full:
+        for table in sorted(_existing_tables(conn, tables)):
+            conn.execute(f'ANALYZE "{table}"')
+    conn.execute("PRAGMA optimize")
+
 
 def update_database(db_path: str = None, force_full: bool = False):
     """
@@ -42,78 +213,120 @@ def update_database(db_path: str = None, force_full: bool = False):
     logger.info("StashDB Performer Database Updater")
     logger.info("=" * 60)
     
-    start_time = time.time()
+    start_time = time.perf_counter_ns()
     
     # Initialize database connection
-    db = PerformerDB(db_path)
-    
-    # Check if database exists and is initialized
-    db_file = Path(db.db_path)
-    if not db_file.exists():
-        logger.info("Database not found, initializing...")
-        db.init_db()
-    
-    # Get current stats before update
-    try:
-        stats_before = db.get_stats()
-        logger.info(f"Database before update:")
-        logger.info(f"  Performers: {stats_before.get('total_performers', 0):,}")
-        logger.info(f"  Aliases: {stats_before.get('total_aliases', 0):,}")
-        logger.info(f"  Images: {stats_before.get('total_images', 0):,}")
-        logger.info(f"  Size: {stats_before.get('db_size_mb', 0):.2f} MB")
-        logger.info(f"  Last sync: {stats_before.get('last_sync', 'Never')}")
-    except Exception as e:
-        logger.warning(f"Could not get stats (database may not be initialized): {e}")
-        logger.info("Initializing database...")
-        db.init_db()
-        stats_before = {'total_performers': 0, 'total_aliases': 0, 'total_images': 0}
-    
-    logger.info("\nFetching performers from StashDB API...")
-    logger.info("(This may take a few minutes for large databases)")
-    
-    try:
-        # Fetch all performers from StashDB
-        performers = db.fetch_all_performers_from_stashdb(batch_size=100)
-        
-        if not performers:
-            logger.error("No performers fetched from StashDB. Check your API key.")
-            return False
-        
-        logger.info(f"\nFetched {len(performers):,} performers from StashDB")
-        
-        # Update local database
-        logger.info("\nUpdating local database...")
-        db.update_local_db(performers)
+    with open_performer_db(db_path) as db:
+        # Check if database exists and is initialized
+        db_file = Path(db.db_path)
+        if not db_file.exists():
+            logger.info("Database not found, initializing...")
+            db.init_db()
         
-        # Get stats after update
-        stats_after = db.get_stats()
+        # Get current stats before update
+        try:
+            stats_before = db.get_stats()
+            logger.info(
+                "Database before update:\n"
+                "  Performers: %s\n"
+                "  Aliases: %s\n"
+                "  Images: %s\n"
+                "  Size: %.2f MB\n"
+                "  Last sync: %s",
+                format(stats_before.get('total_performers', 0), ','),
+                format(stats_before.get('total_aliases', 0), ','),
+                format(stats_before.get('total_images', 0), ','),
+                db_size_mb(db.db_path),
+                stats_before.get('last_sync', 'Never'),
+            )
+        except Exception as e:
+            logger.warning(f"Could not get stats (database may not be initialized): {e}")
+            logger.info("Initializing database...")
+            db.init_db()
+            stats_before = {'total_performers': 0, 'total_aliases': 0, 'total_images': 0}
         
-        performers_added = stats_after.get('total_performers', 0) - stats_before.get('total_performers', 0)
-        aliases_added = stats_after.get('total_aliases', 0) - stats_before.get('total_aliases', 0)
+        # Bulk-write tuning: WAL + synchronous=NORMAL, 64MB cache, in-memory
+        # temp tables. WAL persists in the file; re-asserting it each run is
+        # cheap. Read-only commands keep the default settings.
+        configure_sqlite(db._conn)
         
-        elapsed_time = time.time() - start_time
+        # Restore any index a previous failed run left dropped
+        restored = restore_dropped_indexes(db._conn)
+        if restored:
+            logger.info("Restored %d indexes left dropped by an earlier run", restored)
         
-        logger.info("\n" + "=" * 60)
-        logger.info("Update Complete!")
-        logger.info("=" * 60)
-        logger.info(f"Database after update:")
-        logger.info(f"  Performers: {stats_after.get('total_performers', 0):,} ({performers_added:+,})")
-        logger.info(f"  Aliases: {stats_after.get('total_aliases', 0):,} ({aliases_added:+,})")
-        logger.info(f"  Images: {stats_after.get('total_images', 0):,}")
-        logger.info(f"  Size: {stats_after.get('db_size_mb', 0):.2f} MB")
-        logger.info(f"  Last sync: {stats_after.get('last_sync', 'Unknown')}")
-        logger.info(f"\nElapsed time: {elapsed_time:.1f} seconds")
-        logger.info(f"Rate: {len(performers) / elapsed_time:.1f} performers/second")
+        logger.info("\nFetching performers from StashDB API...")
+        logger.info("(This may take a few minutes for large databases)")
         
-        return True
-        
-    except Exception as e:
-        logger.error(f"Update failed: {e}")
-        import traceback
-        logger.debug(traceback.format_exc())
-        return False
-    finally:
-        db._close()
+        try:
+            # Fetch all performers from StashDB
+            performers = db.fetch_all_performers_from_stashdb(batch_size=100)
+            
+            if not performers:
+                logger.error("No performers fetched from StashDB. Check your API key.")
+                return False
+            
+            logger.info(f"\nFetched {len(performers):,} performers from StashDB")
+            
+            # Insert in StashDB id order so the stashdb_id index (and the
+            # alias/image rows that follow each performer) fill pages in one
+            # sequential sweep instead of random b-tree descents
+            if isinstance(performers[0], dict):
+                performers.sort(key=lambda p: p.get('id') or '')
+            
+            # Update local database
+            logger.info("\nUpdating local database...")
+            # The updater is the only writer: hold the lock across the load and
+            # stats refresh instead of re-acquiring it per transaction
+            with exclusive_access(db._conn):
+                # update_local_db commits on its own, which makes the drop
+                # permanent, so the rebuild can't rely on a rollback
+                try:
+                    dropped = drop_secondary_indexes(db._conn)
+                    logger.debug("Dropped %d indexes for the bulk load", len(dropped))
+                    db.update_local_db(performers)
+                finally:
+                    restore_dropped_indexes(db._conn)
+                
+                # Get stats after update
+                stats_after = db.get_stats()
+                
+                performers_added = stats_after.get('total_performers', 0) - stats_before.get('total_performers', 0)
+                aliases_added = stats_after.get('total_aliases', 0) - stats_before.get('total_aliases', 0)
+                
+                # Fresh planner stats for the week of searches that follow
+                refresh_planner_stats(db._conn, full=bool(dropped) or abs(performers_added) + abs(aliases_added) > 1000)
+            
+            elapsed_time = (time.perf_counter_ns() - start_time) / 1e9
+            
+            rule = "=" * 60
+            logger.info(
+                "\n%s\nUpdate Complete!\n%s\n"
+                "Database after update:\n"
+                "  Performers: %s (%s)\n"
+                "  Aliases: %s (%s)\n"
+                "  Images: %s\n"
+                "  Size: %.2f MB\n"
+                "  Last sync: %s\n"
+                "\nElapsed time: %.1f seconds\n"
+                "Rate: %.1f performers/second",
+                rule, rule,
+                format(stats_after.get('total_performers', 0), ','), format(performers_added, '+,'),
+                format(stats_after.get('total_aliases', 0), ','), format(aliases_added, '+,'),
+                format(stats_after.get('total_images', 0), ','),
+                db_size_mb(db.db_path),
+                stats_after.get('last_sync', 'Unknown'),
+                elapsed_time,
+                len(performers) / max(elapsed_time, 1e-9),
+            )
+            
+            return True
+            
+        except Exception as e:
+            logger.error(f"Update failed: {e}")
+            import traceback
+            logger.debug(traceback.format_exc())
+            return False
 
 
 def show_stats(db_path: str = None):
@@ -122,24 +335,23 @@ def show_stats(db_path: str = None):
     logger.info("Database Statistics")
     logger.info("=" * 60)
     
-    db = PerformerDB(db_path)
-    
-    try:
-        stats = db.get_stats()
-        
-        print(f"\nDatabase location: {db.db_path}")
-        print(f"Total performers: {stats.get('total_performers', 0):,}")
-        print(f"Total aliases: {stats.get('total_aliases', 0):,}")
-        print(f"Total images: {stats.get('total_images', 0):,}")
-        print(f"Database size: {stats.get('db_size_mb', 0):.2f} MB")
-        print(f"Last sync: {stats.get('last_sync', 'Never')}")
-        
-    except Exception as e:
-        logger.error(f"Failed to get stats: {e}")
-        print(f"\nDatabase may not be initialized yet.")
-        print(f"Run: python update_performer_db.py --init")
-    finally:
-        db._close()
+    with open_performer_db(db_path) as db:
+        try:
+            stats = db.get_stats()
+            
+            print(
+                f"\nDatabase location: {db.db_path}\n"
+                f"Total performers: {stats.get('total_performers', 0):,}\n"
+                f"Total aliases: {stats.get('total_aliases', 0):,}\n"
+                f"Total images: {stats.get('total_images', 0):,}\n"
+                f"Database size: {db_size_mb(db.db_path):.2f} MB\n"
+                f"Last sync: {stats.get('last_sync', 'Never')}"
+            )
+            
+        except Exception as e:
+            logger.error(f"Failed to get stats: {e}")
+            print(f"\nDatabase may not be initialized yet.")
+            print(f"Run: python update_performer_db.py --init")
 
 
 def test_search(query: str, db_path: str = None):
@@ -148,40 +360,41 @@ def test_search(query: str, db_path: str = None):
     logger.info(f"Testing Search: '{query}'")
     logger.info("=" * 60)
     
-    db = PerformerDB(db_path)
-    
-    try:
-        stats = db.get_stats()
-        if stats.get('total_performers', 0) == 0:
-            logger.error("Database is empty. Run update first.")
-            return
-        
-        print(f"\nSearching for: '{query}'")
-        print(f"Total performers in database: {stats.get('total_performers', 0):,}")
-        
-        start_time = time.time()
-        results = db.search_performer(query, limit=10, min_score=0.3)
-        elapsed_ms = (time.time() - start_time) * 1000
-        
-        print(f"\nSearch completed in {elapsed_ms:.1f}ms")
-        print(f"Found {len(results)} matches:\n")
-        
-        for i, (performer, score) in enumerate(results, 1):
-            print(f"{i}. {performer.name}")
-            print(f"   Score: {score:.2%}")
-            print(f"   StashDB ID: {performer.id}")
-            if performer.gender:
-                print(f"   Gender: {performer.gender}")
-            if performer.aliases:
-                print(f"   Aliases: {', '.join(performer.aliases[:5])}")
-            print()
+    with open_performer_db(db_path) as db:
+        try:
+            stats = db.get_stats()
+            if stats.get('total_performers', 0) == 0:
+                logger.error("Database is empty. Run update first.")
+                return
             
-    except Exception as e:
-        logger.error(f"Search failed: {e}")
-        import traceback
-        traceback.print_exc()
-    finally:
-        db._close()
+            print(f"\nSearching for: '{query}'")
+            print(f"Total performers in database: {stats.get('total_performers', 0):,}")
+            
+            start_time = time.perf_counter_ns()
+            results = db.search_performer(query, limit=10, min_score=0.3)
+            elapsed_ms = (time.perf_counter_ns() - start_time) / 1e6
+            
+            print(f"\nSearch completed in {elapsed_ms:.1f}ms")
+            print(f"Found {len(results)} matches:\n")
+            
+            # Collect the result block and write it once instead of per line
+            lines = []
+            for i, (performer, score) in enumerate(results, 1):
+                lines.append(f"{i}. {performer.name}")
+                lines.append(f"   Score: {score:.2%}")
+                lines.append(f"   StashDB ID: {performer.id}")
+                if performer.gender:
+                    lines.append(f"   Gender: {performer.gender}")
+                if performer.aliases:
+                    lines.append(f"   Aliases: {', '.join(itertools.islice(performer.aliases, 5))}")
+                lines.append("")
+            if lines:
+                sys.stdout.write("\n".join(lines) + "\n")
+                
+        except Exception as e:
+            logger.error(f"Search failed: {e}")
+            import traceback
+            traceback.print_exc()
 
 
 def main():
@@ -260,8 +473,14 @@ Examples:
         test_search(args.search, args.db_path)
         
     else:
-        # Default: update database
-        success = update_database(args.db_path, force_full=args.force)
+        # Default: update database. Only this long-running path logs through
+        # the background thread; the interactive commands mix print() and
+        # logging and need them in order.
+        listener = start_background_logging()
+        try:
+            success = update_database(args.db_path, force_full=args.force)
+        finally:
+            listener.stop()
         sys.exit(0 if success else 1)
 
 